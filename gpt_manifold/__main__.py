@@ -1,4 +1,137 @@
-from .gpt_manifold import init
+import argparse
+
+models = ["gpt-3.5-turbo", "gpt-4"]
+
+
+def build_parser():
+    model_parser = argparse.ArgumentParser(add_help=False)
+    model_parser.add_argument(
+        "--model", default="gpt-3.5-turbo", choices=models)
+    model_parser.add_argument("--max-bet", type=int, default=10)
+    model_parser.add_argument("--ensemble", default="",
+                              help="Comma-separated models to query in parallel for every prediction")
+
+    batch_parser = argparse.ArgumentParser(add_help=False)
+    batch_parser.add_argument("--batch-size", type=int)
+    batch_parser.add_argument("--concurrency", type=int)
+    batch_parser.add_argument("--pack-size", type=int,
+                              help="Predict up to this many markets in one completion (default 1)")
+    batch_parser.add_argument("--comment", action="store_true",
+                              help="Post the reasoning as a comment on every bet")
+    batch_parser.add_argument("--all-markets", action="store_true",
+                              help="Sample recent markets instead of only new ones")
+    batch_parser.add_argument("--metrics-port", type=int,
+                              help="Expose Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    batch_parser.add_argument("--allocate", action="store_true",
+                              help="Size all bets of a batch together with fractional Kelly once it is evaluated")
+    batch_parser.add_argument("--kelly", type=float,
+                              help="Fraction of the Kelly bet to place when allocating (default 0.25)")
+    batch_parser.add_argument("--budget", type=int,
+                              help="Maximum play money to commit per batch when allocating (default: balance)")
+    batch_parser.add_argument("--watched", action="store_true",
+                              help="Only re-evaluate previously predicted markets whose probability or description changed")
+    batch_parser.add_argument("--drift", type=float,
+                              help="Probability change that triggers a re-evaluation of a watched market (default 0.05)")
+
+    parser = argparse.ArgumentParser(prog="gpt_manifold")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("browse", parents=[model_parser],
+                          help="Browse markets and groups interactively")
+    predict_parser = subparsers.add_parser("predict", parents=[model_parser],
+                                           help="Predict a single market given its id or URL")
+    predict_parser.add_argument("market")
+    predict_parser.add_argument("--yes", action="store_true",
+                                help="Place the bet without asking for confirmation")
+    predict_parser.add_argument("--comment", action="store_true",
+                                help="Post the reasoning as a comment after betting without confirmation")
+    auto_parser = subparsers.add_parser("auto", parents=[model_parser, batch_parser],
+                                        help="Run a single autonomous batch and exit")
+    auto_parser.add_argument("--single", action="store_true",
+                             help="Bet on one market chosen from the ranked groups instead of running a batch")
+    auto_parser.add_argument("--fast", action="store_true",
+                             help="With --single, choose from the ranked shortlist locally instead of asking the model")
+    auto_parser.add_argument("--rank-query",
+                             help="With --single, topics the group and market titles are ranked against")
+    serve_parser = subparsers.add_parser("serve", parents=[model_parser, batch_parser],
+                                         help="Run autonomous batches on a schedule without exiting")
+    serve_parser.add_argument("--interval", type=int, default=900,
+                              help="Seconds between the start of two batches")
+    serve_parser.add_argument("--iterations", type=int)
+    backtest_parser = subparsers.add_parser("backtest", parents=[model_parser],
+                                            help="Replay predictions over resolved markets and score them")
+    backtest_parser.add_argument("--markets", type=int, default=1000,
+                                 help="Number of resolved markets to collect and replay")
+    backtest_parser.add_argument("--concurrency", type=int, default=20)
+    backtest_parser.add_argument("--run",
+                                 help="Name of the run; rerunning the same name resumes from its checkpoint")
+    backtest_parser.add_argument("--horizon", type=float, default=0.5,
+                                 help="Point of the market lifetime at which the probability is replayed (0-1)")
+    backtest_parser.add_argument("--bankroll", type=int, default=1000)
+    backtest_parser.add_argument("--offline", action="store_true",
+                                 help="Only replay markets already in the local dataset")
+    subparsers.add_parser(
+        "bench", help="Benchmark the batch pipeline against local fake APIs", add_help=False)
+    return parser
+
+
+def configure(args, completions=True):
+    from . import gpt_manifold as app
+    app.init_clients(completions)
+    app.model = args.model
+    app.ensemble_models = [member for member in args.ensemble.split(",") if member]
+    app.max_bet = args.max_bet
+    return app
+
+
+def run_batches(args, interval=0, iterations=1):
+    from .daemon import serve
+    serve(args.model, args.max_bet, interval, args.comment,
+          not args.all_markets, args.batch_size, args.concurrency, iterations,
+          [member for member in args.ensemble.split(",") if member], args.metrics_port,
+          args.allocate, args.kelly, args.budget, args.watched, args.drift, args.pack_size)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command != "bench":
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    unknown = [member for member in getattr(args, "ensemble", "").split(",") if member and member not in models]
+    if unknown:
+        parser.error(f"unknown ensemble models: {', '.join(unknown)} (choose from {', '.join(models)})")
+
+    if args.command == "browse":
+        app = configure(args, False)
+        app.choose_navigation()
+    elif args.command == "predict":
+        app = configure(args)
+        if "/" in args.market:
+            market = app.get_market_data_by_url(args.market)
+        else:
+            market = app.get_market_data(args.market)
+        app.prompt_for_prediction(market.id, args.yes, args.comment)
+    elif args.command == "auto" and args.single:
+        app = configure(args)
+        app.start_journal_drain()
+        app.fast_selection = args.fast
+        app.rank_query = args.rank_query or app.rank_query
+        app.prompt_for_group(True, args.comment)
+    elif args.command == "auto":
+        run_batches(args)
+    elif args.command == "serve":
+        run_batches(args, args.interval, args.iterations)
+    elif args.command == "backtest":
+        import json
+        from .backtest import run_backtest
+        print(json.dumps(run_backtest(args.model, args.max_bet, args.markets, args.concurrency, args.run,
+                                      args.horizon, args.bankroll, collect=not args.offline), indent=2))
+    elif args.command == "bench":
+        from .bench import main as bench
+        bench(extra)
+    else:
+        from .gpt_manifold import init
+        init()
+
 
 if __name__ == "__main__":
-    init()
+    main()
@@ -0,0 +1,48 @@
+from typing import NamedTuple
+
+
+class Allocation(NamedTuple):
+    market_id: str
+    action: str
+    amount: int
+    edge: float
+
+
+def kelly_fraction(estimate, probability, action):
+    if action == "YES":
+        return (estimate - probability) / (1 - probability) if probability < 1 else 0
+    return (probability - estimate) / probability if probability > 0 else 0
+
+
+def size_position(probability, decision, estimate, bankroll, multiplier, max_bet):
+    # The model's call decides whether and which way to bet, the estimate only sizes it
+    if decision.action not in ("YES", "NO"):
+        return None
+    if estimate is None:
+        return decision.action, min(decision.amount, max_bet), 0.0
+    fraction = kelly_fraction(estimate, probability, decision.action)
+    if fraction <= 0:
+        return None
+    return decision.action, min(fraction * multiplier * bankroll, max_bet), abs(estimate - probability)
+
+
+def allocate(predictions, bankroll, budget, max_bet, multiplier=0.25, min_bet=1):
+    positions = []
+    for market_id, probability, decision, estimate in predictions:
+        position = size_position(
+            probability, decision, estimate, bankroll, multiplier, max_bet)
+        if position is not None:
+            positions.append((market_id, *position))
+    total = sum(amount for _market_id, _action, amount, _edge in positions)
+    scale = min(1.0, budget / total) if total > 0 else 0
+    positions.sort(key=lambda position: position[3], reverse=True)
+
+    allocations = []
+    remaining = budget
+    for market_id, action, amount, edge in positions:
+        amount = min(int(amount * scale), int(remaining))
+        if amount < min_bet:
+            continue
+        allocations.append(Allocation(market_id, action, amount, edge))
+        remaining -= amount
+    return allocations
@@ -0,0 +1,251 @@
+"""
+Replays the prediction prompt over resolved markets at a historical probability and scores the answers.
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from . import gpt_manifold as app
+from .decision import scan_estimate
+from .hydrate import Hydrator
+from .lazy import lazy_import
+from .models import Market
+
+openai = lazy_import("openai")
+
+dataset_path = os.path.join(os.path.expanduser(
+    "~"), ".cache", "gpt_manifold", "backtest.db")
+calibration_bins = 10
+bet_page_size = 1000
+max_bet_pages = 20
+
+
+class BacktestStore:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS markets (id TEXT PRIMARY KEY, data TEXT, probability REAL, outcome INTEGER, horizon REAL);
+                CREATE TABLE IF NOT EXISTS skipped (id TEXT PRIMARY KEY);
+                CREATE TABLE IF NOT EXISTS cursor (horizon REAL PRIMARY KEY, before_id TEXT, exhausted INTEGER);
+                CREATE TABLE IF NOT EXISTS results (run TEXT, id TEXT, action TEXT, amount INTEGER, estimate REAL,
+                                                    probability REAL, outcome INTEGER, pnl REAL, answer TEXT, PRIMARY KEY (run, id));
+            """)
+
+    def count_markets(self, horizon):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM markets WHERE horizon = ?", (horizon,)).fetchone()[0]
+
+    def get_cursor(self, horizon):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT before_id, exhausted FROM cursor WHERE horizon = ?", (horizon,)).fetchone()
+        return ("", False) if row is None else (row[0], row[1] == 1)
+
+    def put_cursor(self, horizon, before_id, exhausted=False):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO cursor (horizon, before_id, exhausted) VALUES (?, ?, ?)",
+                                    (horizon, before_id, 1 if exhausted else 0))
+
+    def find_known(self, market_ids):
+        ids = json.dumps(list(market_ids))
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM markets WHERE id IN (SELECT value FROM json_each(?)) "
+                "UNION SELECT id FROM skipped WHERE id IN (SELECT value FROM json_each(?))", (ids, ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def put_market(self, data, probability, outcome, horizon):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO markets (id, data, probability, outcome, horizon) VALUES (?, ?, ?, ?, ?)",
+                                    (data["id"], json.dumps(data), probability, outcome, horizon))
+
+    def skip_market(self, market_id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO skipped (id) VALUES (?)", (market_id,))
+
+    def get_pending(self, run, horizon, limit):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT data, probability, outcome FROM markets WHERE horizon = ? AND id NOT IN "
+                "(SELECT id FROM results WHERE run = ?) ORDER BY id LIMIT ?", (horizon, run, limit)).fetchall()
+        return [(json.loads(data), probability, outcome) for data, probability, outcome in rows]
+
+    def put_result(self, run, market_id, decision, estimate, probability, outcome, pnl, answer):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results (run, id, action, amount, estimate, probability, outcome, pnl, answer) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (run, market_id, decision.action, decision.amount, estimate, probability, outcome, pnl, answer))
+
+    def get_results(self, run):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT action, amount, estimate, probability, outcome, pnl FROM results WHERE run = ?", (run,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def is_binary_resolved(data):
+    return data.get("isResolved") and data.get("outcomeType", "BINARY") == "BINARY" and data.get("resolution") in ("YES", "NO")
+
+
+def cutoff_time(data, horizon):
+    started = data.get("createdTime")
+    ended = data.get("resolutionTime") or data.get("closeTime")
+    if started is None or ended is None:
+        return None
+    return started + horizon * (ended - started)
+
+
+def historical_probability(data, bets, horizon):
+    cutoff = cutoff_time(data, horizon)
+    if cutoff is None or not bets:
+        return None
+    before = [bet for bet in bets if bet["createdTime"] <= cutoff]
+    if before:
+        return max(before, key=lambda bet: bet["createdTime"])["probAfter"]
+    return min(bets, key=lambda bet: bet["createdTime"])["probBefore"]
+
+
+def load_market(market_id, horizon):
+    data = app.fetch_market_data(market_id)
+    cutoff = cutoff_time(data, horizon)
+    bets = []
+    before_id = None
+    for _ in range(max_bet_pages):
+        page = app.fetch_market_bets(
+            market_id, limit=bet_page_size, before_id=before_id)
+        bets.extend(page)
+        if len(page) < bet_page_size or (cutoff is not None and min(bet["createdTime"] for bet in page) <= cutoff):
+            return data, bets
+        before_id = page[-1]["id"]
+    # The history does not reach back to the cutoff, so the market is skipped rather than replayed at a later probability
+    return data, None
+
+
+def collect_markets(store, count, horizon=0.5, concurrency=8):
+    hydrator = Hydrator(lambda market_id: load_market(
+        market_id, horizon), concurrency)
+    before_id, exhausted = store.get_cursor(horizon)
+    try:
+        while not exhausted and store.count_markets(horizon) < count:
+            page = app.fetch_all_markets(before_id)
+            if len(page) == 0:
+                store.put_cursor(horizon, before_id, True)
+                break
+            known = store.find_known(market["id"] for market in page)
+            candidates = [market["id"] for market in page
+                          if is_binary_resolved(market) and market["id"] not in known]
+            for market_id, result in hydrator.hydrate(candidates, return_exceptions=True).items():
+                if isinstance(result, Exception):
+                    continue
+                data, bets = result
+                probability = historical_probability(data, bets, horizon)
+                if probability is None or not is_binary_resolved(data):
+                    store.skip_market(market_id)
+                    continue
+                store.put_market(
+                    data, probability, 1 if data["resolution"] == "YES" else 0, horizon)
+            before_id = page[-1]["id"]
+            store.put_cursor(horizon, before_id)
+    finally:
+        hydrator.close()
+    return store.count_markets(horizon)
+
+
+def simulate_pnl(decision, probability, outcome):
+    if decision.action == "YES":
+        return decision.amount / probability * outcome - decision.amount
+    if decision.action == "NO":
+        return decision.amount / (1 - probability) * (1 - outcome) - decision.amount
+    return 0.0
+
+
+async def replay_markets(store, run, markets, concurrency, horizon=0.5):
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = []
+
+    async def replay(data, probability, outcome):
+        async with semaphore:
+            market = Market(data["id"], data["question"], probability,
+                            description=data.get("textDescription", ""))
+            try:
+                # The prompt date is the replay cutoff, so the model is not told a date after resolution
+                cutoff = cutoff_time(data, horizon)
+                answer = await app.get_completion_async(app.build_prediction_messages(
+                    market, date=datetime.datetime.fromtimestamp(cutoff / 1000)))
+            except (RuntimeError, openai.error.OpenAIError) as error:
+                failures.append((market.id, str(error)))
+                return
+            decision = app.parse_decision(answer)
+            store.put_result(run, market.id, decision, scan_estimate(answer), probability,
+                             outcome, simulate_pnl(decision, probability, outcome), answer)
+
+    await asyncio.gather(*[replay(data, probability, outcome) for data, probability, outcome in markets])
+    return failures
+
+
+def score(results):
+    if len(results) == 0:
+        return {"markets": 0}
+    estimated = [(estimate, probability, outcome) for _action, _amount, estimate, probability, outcome, _pnl in results
+                 if estimate is not None]
+    bins = [[0, 0.0, 0] for _ in range(calibration_bins)]
+    for estimate, _probability, outcome in estimated:
+        index = min(int(estimate * calibration_bins), calibration_bins - 1)
+        bins[index][0] += 1
+        bins[index][1] += estimate
+        bins[index][2] += outcome
+    bets = [(amount, pnl) for action, amount, _estimate, _probability, _outcome, pnl in results
+            if action in ("YES", "NO")]
+    staked = sum(amount for amount, _pnl in bets)
+    pnl = sum(pnl for _amount, pnl in bets)
+    return {
+        "markets": len(results),
+        "estimates": len(estimated),
+        "brier_model": round(sum((estimate - outcome) ** 2 for estimate, _probability, outcome in estimated) / max(len(estimated), 1), 4),
+        "brier_market": round(sum((probability - outcome) ** 2 for _estimate, probability, outcome in estimated) / max(len(estimated), 1), 4),
+        "calibration": [{"bin": f"{index / calibration_bins:.1f}-{(index + 1) / calibration_bins:.1f}", "count": count,
+                         "mean_estimate": round(total / count, 3), "frequency": round(outcomes / count, 3)}
+                        for index, (count, total, outcomes) in enumerate(bins) if count > 0],
+        "bets": len(bets),
+        "staked": staked,
+        "pnl": round(pnl, 2),
+        "roi": round(pnl / staked, 4) if staked else 0.0,
+    }
+
+
+def run_backtest(model, max_bet, count=1000, concurrency=20, run=None, horizon=0.5, bankroll=1000, path=None, collect=True):
+    app.init_clients()
+    app.model = model
+    app.max_bet = max_bet
+    app.balance = bankroll
+    app.quiet = True
+    store = BacktestStore(path or os.getenv("GPT_MANIFOLD_BACKTEST", dataset_path))
+    run = run or f"{model}-{max_bet}-{horizon}"
+    try:
+        started = time.monotonic()
+        if collect:
+            collect_markets(store, count, horizon, app.hydrate_concurrency)
+        markets = store.get_pending(run, horizon, count)
+        failures = asyncio.get_event_loop().run_until_complete(
+            replay_markets(store, run, markets, concurrency, horizon))
+        report = {"run": run, "replayed": len(markets) - len(failures), "failed": len(failures),
+                  "elapsed_seconds": round(time.monotonic() - started, 3), **score(store.get_results(run))}
+    finally:
+        store.close()
+    return report
@@ -0,0 +1,392 @@
+"""
+Benchmarks the autonomous batch pipeline against local stand-ins for the Manifold and OpenAI APIs.
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+
+from . import gpt_manifold as app
+from .decision import abstain, parse_decision
+from .streaming import TagStream
+
+decisions = ["<YES>{amount}</YES>", "<NO>{amount}</NO>", "<ABSTAIN/>"]
+heavy_modules = ("openai", "requests", "pick", "numpy", "tiktoken")
+import_probe = """
+import json, sys, time
+started = time.perf_counter()
+import gpt_manifold.__main__, gpt_manifold.gpt_manifold
+elapsed = time.perf_counter() - started
+print(json.dumps([elapsed, [name for name in {heavy_modules!r} if type(sys.modules.get(name)).__name__ == "module"]]))
+"""
+fuzz_fragments = ["<YES>", "</YES>", "<NO>", "</NO>", "<ABSTAIN/>", "<ABSTAIN />", "<ABSTAIN>", '<MARKET id="a">',
+                  "</MARKET>", "<", ">", "/", "10", "1,000", "-5", "0", "0.5", "1e3", "10.5", "1,00", "mana", "M$", "AMOUNT", " ", "\n", "YES", "NO",
+                  "<YES>abc</YES>"]
+
+
+class FakeApi:
+    def __init__(self, markets=500, groups=20, latency=0.02, completion_latency=0.2, error_rate=0.0, seed=0):
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.completion_latency = completion_latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.fetched = {}
+        self.bet_latencies = []
+        self.placed = {}
+        self.comments = {}
+        self.markets = [{
+            "id": f"market-{index:05d}",
+            "slug": f"market-{index:05d}",
+            "question": f"Will benchmark event {index} happen?",
+            "textDescription": f"Benchmark market {index}. " * 20,
+            "creatorName": "Bench",
+            "probability": self.random.uniform(0.05, 0.95),
+            "isResolved": index % 10 == 0,
+            "outcomeType": "BINARY",
+            "createdTime": index,
+            "resolutionTime": index + 10 if index % 10 == 0 else None,
+            "resolution": self.random.choice(["YES", "NO"]) if index % 10 == 0 else None,
+        } for index in range(markets, 0, -1)]
+        self.by_id = {market["id"]: market for market in self.markets}
+        self.groups = [{
+            "id": f"group-{index}",
+            "name": f"Benchmark group {index}",
+            "totalContracts": len(self.markets[index::groups]),
+        } for index in range(groups)]
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def route(self, method, path, body):
+        path, _, query = path.partition("?")
+        params = dict(part.split("=", 1) for part in query.split("&") if "=" in part)
+        segments = path.split("/")
+        if path == "/v1/chat/completions":
+            return "completion", self.completion(body)
+        endpoint = re.sub(r"/(market|slug|by-id)/[^/]+", r"/\1/{id}", path)
+        if path == "/api/v0/groups":
+            return endpoint, self.groups
+        if path.startswith("/api/v0/group/by-id/"):
+            index = int(segments[4].split("-")[1])
+            return endpoint, self.markets[index::len(self.groups)]
+        if path == "/api/v0/markets":
+            before = params.get("before", "")
+            limit = int(params.get("limit", 100))
+            start = self.markets.index(self.by_id[before]) + 1 if before in self.by_id else 0
+            return endpoint, self.markets[start:start + limit]
+        if path.startswith("/api/v0/market/") or path.startswith("/api/v0/slug/"):
+            market = self.by_id.get(segments[4])
+            if market is not None:
+                with self.lock:
+                    self.fetched.setdefault(market["id"], time.monotonic())
+            return endpoint, market
+        if path == "/api/v0/bets":
+            market = self.by_id.get(params.get("contractId"))
+            if market is None:
+                return endpoint, None
+            if "userId" in params:
+                with self.lock:
+                    return endpoint, list(self.placed.get(market["id"], []))
+            return endpoint, [{"contractId": market["id"], "createdTime": market["createdTime"] + offset,
+                               "probBefore": market["probability"], "probAfter": market["probability"]}
+                              for offset in (9, 5, 1)]
+        if path == "/api/v0/me":
+            return endpoint, {"id": "bench", "balance": 1000}
+        if path == "/api/v0/bet":
+            bet = {"id": f"bet-{self.random.random()}", "userId": "bench", "contractId": body["contractId"],
+                   "outcome": body["outcome"], "amount": body["amount"], "createdTime": time.time() * 1000}
+            with self.lock:
+                started = self.fetched.get(body["contractId"])
+                if started is not None:
+                    self.bet_latencies.append(time.monotonic() - started)
+                self.placed.setdefault(body["contractId"], []).append(bet)
+            return endpoint, {"betId": bet["id"]}
+        if path == "/api/v0/comments":
+            with self.lock:
+                return endpoint, list(self.comments.get(params.get("contractId"), []))
+        if path == "/api/v0/comment":
+            comment = {"id": f"comment-{self.random.random()}", "userId": "bench",
+                       "contractId": body["contractId"], "createdTime": time.time() * 1000}
+            with self.lock:
+                self.comments.setdefault(body["contractId"], []).append(comment)
+            return endpoint, comment
+        return endpoint, None
+
+    def completion(self, body):
+        time.sleep(self.completion_latency)
+        prompt = body["messages"][-1]["content"]
+        market_ids = re.findall(r"^Market id: (\S+)$", prompt, re.MULTILINE)
+        amount = self.random.randint(1, 10)
+        estimate = self.random.randint(1, 99)
+        if market_ids:
+            return "\n\n".join(f'Reasoning about {market_id}.\n<PROBABILITY>{estimate}%</PROBABILITY>\n<MARKET id="{market_id}">{self.random.choice(decisions).format(amount=amount)}</MARKET>'
+                               for market_id in market_ids)
+        return f"Some reasoning about the market.\n<PROBABILITY>{estimate}%</PROBABILITY>\n\n{self.random.choice(decisions).format(amount=amount)}"
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.respond("GET", None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.respond("POST", json.loads(self.rfile.read(length) or b"{}"))
+
+            def respond(self, method, body):
+                endpoint, data = api.route(method, self.path, body)
+                api.count(f"{method} {endpoint}")
+                time.sleep(api.latency)
+                if api.random.random() < api.error_rate:
+                    return self.send_json(503, {"error": "Injected failure"})
+                if data is None:
+                    return self.send_json(404, {"error": "Not found"})
+                if endpoint != "completion":
+                    return self.send_json(200, data)
+                if body.get("stream"):
+                    return self.send_stream(data)
+                self.send_json(200, {"id": "bench", "object": "chat.completion", "model": body["model"],
+                                     "choices": [{"index": 0, "finish_reason": "stop",
+                                                  "message": {"role": "assistant", "content": data}}]})
+
+            def send_json(self, status, data):
+                payload = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_stream(self, text):
+                chunks = [text[index:index + 16] for index in range(0, len(text), 16)]
+                events = "".join("data: " + json.dumps({"id": "bench", "object": "chat.completion.chunk",
+                                                        "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}) + "\n\n"
+                                 for chunk in chunks) + "data: [DONE]\n\n"
+                payload = events.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@contextlib.contextmanager
+def bench_environment(api):
+    directory = tempfile.mkdtemp(prefix="gpt_manifold_bench_")
+    environment = {
+        "OPENAI_API_KEY": "bench",
+        "MANIFOLD_API_KEY": "bench",
+        "MANIFOLD_API_URL": f"{api.url}/api/v0",
+        "GPT_MANIFOLD_STORE": os.path.join(directory, "snapshot.db"),
+        "GPT_MANIFOLD_COMPLETIONS": os.path.join(directory, "completions.db"),
+        "GPT_MANIFOLD_JOURNAL": os.path.join(directory, "journal.db"),
+        "GPT_MANIFOLD_LOG": os.path.join(directory, "gpt_manifold.jsonl"),
+    }
+    previous_environment = {key: os.environ.get(key) for key in environment}
+    previous_directory = os.getcwd()
+    previous_api_base = openai.api_base
+    previous_rate_limits = app.rate_limits
+    os.environ.update(environment)
+    os.chdir(directory)
+    try:
+        openai.api_base = f"{api.url}/v1"
+        app.rate_limits = {kind: (10000, 10000) for kind in app.rate_limits}
+        app.cache.clear()
+        app.metrics.reset()
+        yield directory
+    finally:
+        app.rate_limits = previous_rate_limits
+        openai.api_base = previous_api_base
+        os.chdir(previous_directory)
+        for key, value in previous_environment.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        api.stop()
+
+
+def run_pipeline(markets=200, concurrency=20, latency=0.02, completion_latency=0.2, error_rate=0.0, pack_size=1, seed=0, allocate=False):
+    api = FakeApi(markets * 2, latency=latency, completion_latency=completion_latency,
+                  error_rate=error_rate, seed=seed).start()
+    with bench_environment(api):
+        app.batch_size = markets
+        app.batch_concurrency = concurrency
+        app.pack_size = pack_size
+        app.allocate_bets = allocate
+        app.quiet = True
+        app.init_clients()
+        app.model = "gpt-3.5-turbo"
+        app.max_bet = 10
+        started = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.prompt_for_batch(False, False)
+        elapsed = time.monotonic() - started
+
+    latencies = sorted(api.bet_latencies)
+    evaluated = api.requests.get("GET /api/v0/market/{id}", 0)
+    return {
+        "markets": markets,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "markets_per_second": round(evaluated / elapsed, 2),
+        "bets": len(latencies),
+        "duplicate_bets": sum(len(bets) - 1 for bets in api.placed.values()),
+        "bet_latency_p50": round(percentile(latencies, 0.5), 3),
+        "bet_latency_p99": round(percentile(latencies, 0.99), 3),
+        "requests": dict(sorted(api.requests.items())),
+    }
+
+
+def run_backtest_bench(markets=200, concurrency=20, latency=0.02, completion_latency=0.2, seed=0):
+    from .backtest import run_backtest
+    api = FakeApi(markets * 10, latency=latency,
+                  completion_latency=completion_latency, seed=seed).start()
+    with bench_environment(api) as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = run_backtest("gpt-3.5-turbo", 10, markets, concurrency,
+                                  path=os.path.join(directory, "backtest.db"))
+    report["markets_per_second"] = round(
+        report["replayed"] / report["elapsed_seconds"], 2)
+    report["requests"] = dict(sorted(api.requests.items()))
+    return report
+
+
+def run_parser_bench(iterations=20000, seed=0):
+    generator = random.Random(seed)
+    for _ in range(iterations):
+        text = "".join(generator.choice(fuzz_fragments)
+                       for _ in range(generator.randint(0, 40)))
+        max_bet = generator.choice([10, 20, 50, 100])
+        balance = generator.randint(0, 200)
+        decision = parse_decision(text, max_bet, balance)
+        assert decision.action in ("YES", "NO", "ABSTAIN"), (text, decision)
+        if decision.action == "ABSTAIN":
+            assert decision.amount == 0, (text, decision)
+        else:
+            assert 0 < decision.amount <= min(max_bet, balance), (text, decision)
+        whole = TagStream()
+        whole.feed(text)
+        chunked = TagStream()
+        position = 0
+        while position < len(text):
+            size = generator.randint(1, 8)
+            chunked.feed(text[position:position + size])
+            position += size
+        assert whole.decision == chunked.decision, (text, whole.decision, chunked.decision)
+        assert (whole.decision or abstain) == parse_decision(text), (text, whole.decision, parse_decision(text))
+
+    completions = [("Some reasoning about the market. " * generator.randint(10, 100)) +
+                   generator.choice(decisions).format(amount=generator.randint(1, 100)) for _ in range(1000)]
+    started = time.perf_counter()
+    for _ in range(20):
+        for completion in completions:
+            parse_decision(completion, 50, 1000)
+    elapsed = time.perf_counter() - started
+    return {
+        "fuzz_cases": iterations,
+        "parses": 20 * len(completions),
+        "parses_per_second": round(20 * len(completions) / elapsed),
+        "mean_parse_microseconds": round(elapsed / (20 * len(completions)) * 1e6, 2),
+    }
+
+
+def run_import_bench(budget=0.15, runs=5):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", import_probe.format(heavy_modules=heavy_modules)],
+                                cwd=root, capture_output=True, text=True, check=True).stdout
+        elapsed, loaded = json.loads(output)
+        timings.append(elapsed)
+    best = min(timings)
+    return {
+        "runs": runs,
+        "import_seconds_best": round(best, 4),
+        "import_seconds_median": round(sorted(timings)[runs // 2], 4),
+        "budget_seconds": budget,
+        "heavy_modules_loaded": loaded,
+        "passed": best <= budget and len(loaded) == 0,
+    }
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return 0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="gpt_manifold bench")
+    parser.add_argument("--markets", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Seconds of latency added to every fake API response")
+    parser.add_argument("--completion-latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allocate", action="store_true",
+                        help="Size the batch with the portfolio allocator instead of betting as decisions arrive")
+    parser.add_argument("--parser", action="store_true",
+                        help="Fuzz and benchmark the decision parser instead of the pipeline")
+    parser.add_argument("--backtest", action="store_true",
+                        help="Benchmark the backtest engine over resolved fake markets instead of the pipeline")
+    parser.add_argument("--imports", action="store_true",
+                        help="Check that importing the CLI stays within --import-budget and loads no heavy dependencies")
+    parser.add_argument("--import-budget", type=float, default=0.15)
+    args = parser.parse_args(argv)
+    if args.imports:
+        report = run_import_bench(args.import_budget)
+        print(json.dumps(report, indent=2))
+        if not report["passed"]:
+            raise SystemExit(1)
+        return report
+    if args.parser:
+        report = run_parser_bench(seed=args.seed)
+    elif args.backtest:
+        report = run_backtest_bench(args.markets, args.concurrency, args.latency,
+                                    args.completion_latency, args.seed)
+    else:
+        report = run_pipeline(args.markets, args.concurrency, args.latency, args.completion_latency,
+                              args.error_rate, args.pack_size, args.seed, args.allocate)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
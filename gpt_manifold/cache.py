@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get_or_set(self, key, ttl, fetch):
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CompletionCache:
+    def __init__(self, path, ttl=86400, maxsize=10000, volatile=()):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.volatile = [re.compile(pattern, re.MULTILINE)
+                         for pattern in volatile]
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, answer TEXT, created REAL, used REAL);
+                CREATE INDEX IF NOT EXISTS completions_used ON completions (used);
+            """)
+
+    def key(self, model, messages):
+        normalized = []
+        for message in messages:
+            content = message["content"]
+            for pattern in self.volatile:
+                content = pattern.sub("", content)
+            normalized.append([message["role"], " ".join(content.split())])
+        payload = json.dumps([model, normalized])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model, messages):
+        key = self.key(model, messages)
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT answer FROM completions WHERE key = ? AND created >= ?", (key, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE completions SET used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, model, messages, answer):
+        key = self.key(model, messages)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completions (key, answer, created, used) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now))
+            self.connection.execute(
+                "DELETE FROM completions WHERE created < ?", (now - self.ttl,))
+            self.connection.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,65 @@
+import requests
+from requests.adapters import HTTPAdapter
+from .journal import UnknownOutcomeError
+from .metrics import metrics
+from .scheduler import parse_retry_after
+
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+class ManifoldClient:
+    def __init__(self, api_key, base_url="https://manifold.markets/api/v0", pool_size=10, timeout=(5, 30), gzip=True, scheduler=None):
+        self.base_url = base_url
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Key {api_key}"
+        self.session.headers["Accept-Encoding"] = "gzip, deflate" if gzip else "identity"
+
+    def get(self, path, params=None):
+        return self.schedule("read", "GET", path, lambda: self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout))
+
+    def post(self, path, body):
+        # Writes are only retried when the request is known not to have been processed
+        try:
+            return self.schedule("write", "POST", path, lambda: self.session.post(f"{self.base_url}{path}", json=body, timeout=self.timeout),
+                                 (requests.exceptions.ConnectTimeout,), retry_rejected_response)
+        except requests.exceptions.ConnectTimeout as error:
+            raise RuntimeError(
+                f"Error: Unable to reach Manifold for POST {path}: {error}") from error
+        except requests.RequestException as error:
+            raise UnknownOutcomeError(
+                f"Error: Outcome of POST {path} is unknown: {error}") from error
+
+    def schedule(self, kind, method, path, request, retry_exceptions=(requests.ConnectionError, requests.Timeout), retry_result=None):
+        endpoint = "/" + path.split("/")[1]
+
+        def counted_request():
+            response = request()
+            metrics.increment("gpt_manifold_manifold_requests_total", method=method,
+                              endpoint=endpoint, status=response.status_code)
+            return response
+
+        with metrics.time("gpt_manifold_manifold_request_seconds", method=method, endpoint=endpoint):
+            if self.scheduler is None:
+                return counted_request()
+            return self.scheduler.call(kind, counted_request, retry_exceptions, retry_result or retry_response)
+
+    def close(self):
+        self.session.close()
+
+
+def retry_response(response):
+    if response.status_code in retry_statuses:
+        return parse_retry_after(response.headers.get("Retry-After"))
+    return None
+
+
+def retry_rejected_response(response):
+    if response.status_code == 429:
+        return parse_retry_after(response.headers.get("Retry-After"))
+    return None
@@ -0,0 +1,35 @@
+import time
+
+from . import gpt_manifold as app
+
+
+def serve(model, max_bet, interval=900, auto_comment=False, new_only=True, batch_size=None, concurrency=None, iterations=None, ensemble_models=(), metrics_port=None, allocate=False, kelly=None, budget=None, watched=False, drift=None, pack_size=None):
+    if batch_size:
+        app.batch_size = batch_size
+    if concurrency:
+        app.batch_concurrency = concurrency
+    if pack_size:
+        app.pack_size = pack_size
+    app.metrics_port = metrics_port
+    app.allocate_bets = allocate
+    if kelly:
+        app.kelly_multiplier = kelly
+    app.allocation_budget = budget
+    if drift:
+        app.drift_threshold = drift
+    app.init_clients()
+    app.start_journal_drain()
+    app.model = model
+    app.ensemble_models = list(ensemble_models)
+    app.max_bet = max_bet
+    iteration = 0
+    while iterations is None or iteration < iterations:
+        started = time.monotonic()
+        try:
+            app.prompt_for_batch(auto_comment, new_only, watched)
+        except Exception as error:
+            # A failed batch must never end the daemon, the next iteration starts from scratch
+            print(f"Batch failed: {error}")
+        iteration += 1
+        if iterations is None or iteration < iterations:
+            time.sleep(max(0, interval - (time.monotonic() - started)))
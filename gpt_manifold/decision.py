@@ -0,0 +1,83 @@
+import re
+from typing import NamedTuple
+
+amount_pattern = re.compile(
+    r'\s*(?:M\$\s*)?(\d{1,3}(?:,\d{3})+|\d+)\s*(?:mana\s*)?', re.IGNORECASE)
+estimate_pattern = re.compile(
+    r'<PROBABILITY>\s*(\d+(?:\.\d+)?)\s*(%?)\s*</PROBABILITY>')
+market_pattern = re.compile(
+    r'<MARKET\s+id=["\']?([^"\'>\s]+)["\']?\s*>(.*?)<\/MARKET>', re.DOTALL)
+action_pattern = re.compile(r'<(YES|NO)>([^<]*)<\/\1>|<ABSTAIN ?\/>')
+
+
+class Decision(NamedTuple):
+    action: str
+    amount: int
+
+
+abstain = Decision("ABSTAIN", 0)
+
+
+def scan_decision(text):
+    # The last valid tag decides, the same rule TagStream applies while streaming
+    for match in reversed(list(action_pattern.finditer(text))):
+        decision = read_action(match)
+        if decision is not None:
+            return decision
+    return abstain
+
+
+def read_action(match):
+    if match.group(1) is None:
+        return abstain
+    # A tag with a malformed amount such as AMOUNT, -5, 1e3 or 10.5 is skipped
+    amount = parse_amount(match.group(2))
+    if amount is None:
+        return None
+    return clamp_decision(Decision(match.group(1), amount))
+
+
+def parse_amount(content):
+    match = amount_pattern.fullmatch(content)
+    if match is None:
+        return None
+    return int(match.group(1).replace(",", ""))
+
+
+def clamp_decision(decision, max_bet=None, balance=None):
+    if decision.action not in ("YES", "NO"):
+        return abstain
+    amount = decision.amount
+    if max_bet is not None:
+        amount = min(amount, int(max_bet))
+    if balance is not None:
+        amount = min(amount, int(balance))
+    if amount <= 0:
+        return abstain
+    return Decision(decision.action, amount)
+
+
+def parse_decision(text, max_bet=None, balance=None):
+    return clamp_decision(scan_decision(text), max_bet, balance)
+
+
+def scan_estimate(text):
+    estimates = []
+    for match in estimate_pattern.finditer(text):
+        value = float(match.group(1))
+        if match.group(2) or value > 1:
+            value /= 100
+        estimates.append(min(max(value, 0.0), 1.0))
+    if len(estimates) == 0:
+        return None
+    return sum(estimates) / len(estimates)
+
+
+def find_market_tags(text):
+    results = {}
+    start = 0
+    for match in market_pattern.finditer(text):
+        reasoning = text[start:match.start()].strip()
+        results[match.group(1)] = f'{reasoning}\n\n{match.group(2).strip()}'
+        start = match.end()
+    return results
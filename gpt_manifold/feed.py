@@ -0,0 +1,81 @@
+import threading
+from queue import Full, Queue
+
+done = object()
+
+
+class FeedSync:
+    def __init__(self, fetch_page, store, page_limit=100, max_pages=None):
+        self.fetch_page = fetch_page
+        self.store = store
+        self.page_limit = page_limit
+        self.max_pages = max_pages
+
+    def iter_new(self):
+        queue = Queue(maxsize=self.page_limit)
+        stop = threading.Event()
+        thread = threading.Thread(target=self.run, args=(queue, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = queue.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                # Only markets handed to the consumer count as seen, the rest stay in the backlog for the next sync
+                self.store.add_feed_markets([item])
+                yield item
+        finally:
+            stop.set()
+
+    def run(self, queue, stop):
+        try:
+            for market in self.store.get_feed_backlog():
+                if not self.put(queue, market, stop):
+                    return
+            cursor = self.store.get_feed_cursor()
+            pages = 0
+            if cursor is not None:
+                # Finish the walk an earlier sync left off before looking for newer markets
+                pages = self.walk(queue, stop, cursor, pages)
+            if pages is not None:
+                self.walk(queue, stop, "", pages)
+        except Exception as error:
+            self.put(queue, error, stop)
+        finally:
+            self.put(queue, done, stop)
+
+    def walk(self, queue, stop, before_id, pages):
+        # Paging stops at the newest market already consumed or backlogged, which marks where the last sync began
+        while self.max_pages is None or pages < self.max_pages:
+            if stop.is_set():
+                return None
+            data = self.fetch_page(before_id)
+            pages += 1
+            known = self.store.find_feed_markets(market["id"] for market in data)
+            new = []
+            for market in data:
+                if market["id"] in known:
+                    break
+                new.append(market)
+            finished = len(new) < len(data) or len(data) < self.page_limit
+            if len(data) > 0:
+                before_id = data[-1]["id"]
+            self.store.add_feed_backlog(new, None if finished else before_id)
+            for market in new:
+                if not self.put(queue, market, stop):
+                    return None
+            if finished:
+                return pages
+        self.store.add_feed_backlog([], None)
+        return pages
+
+    def put(self, queue, item, stop):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
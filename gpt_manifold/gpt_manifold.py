@@ -2,44 +2,173 @@
 A bot that aids in placing bets on manifold.markets using OpenAI's GPT APIs.
 """
 
+import asyncio
 import datetime
+import itertools
 import os
 import random
 import textwrap
-import openai
-import requests
+import time
 import re
-from pick import pick
-from logger import LogSession
-from strings import *
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .allocator import allocate
+from .cache import CompletionCache, TTLCache
+from .decision import Decision, abstain, clamp_decision, find_market_tags, scan_decision, scan_estimate
+from .feed import FeedSync
+from .hydrate import Hydrator
+from .journal import Journal, UnknownOutcomeError
+from .lazy import lazy_import
+from .logger import LogSession
+from .metrics import metrics, serve_metrics
+from .models import Group, Market, MarketColumns
+from .scheduler import Scheduler
+from .store import SnapshotStore
+from .streaming import TagStream
+from .watchlist import find_drifted, has_moved, watch_entry
+from .tokens import count_message_tokens, count_tokens, fit_lines, truncate
+from .strings import *
+
+openai = lazy_import("openai")
 
 model = ""
+ensemble_models = []
+ensemble_weighting = "confidence"
+openai_key = None
 manifold_key = ""
+manifold_url = "https://manifold.markets/api/v0"
+client = None
+client_pool_size = 10
+scheduler = None
+rate_limits = {
+    "read": (8, 16),
+    "write": (2, 4),
+    "completion": (3, 10)
+}
 max_bet = 0
 balance = 0
 page_limit = 100
-group_pool_size = 100
+shortlist_size = 20
+fast_pool_size = 3
+fast_selection = False
+rank_query = "science technology artificial intelligence economics politics elections sports history"
+rank_temperature = 0.05
+sync_max_pages = 20
+batch_size = 20
+batch_concurrency = 5
+hydrator = None
+hydrate_concurrency = 8
+pack_size = 1
+menu_pack_size = 5
+allocate_bets = False
+kelly_multiplier = 0.25
+allocation_budget = None
+drift_threshold = 0.05
+watch_poll_size = 200
+stream_completions = True
+pack_token_budget = 3000
+token_budgets = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192
+}
+completion_reserve = 1024
+completion_prices = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4": (0.03, 0.06)
+}
+metrics_port = None
+metrics_server = None
+description_max_tokens = 1024
+quiet = False
+log_session = LogSession()
+cache = TTLCache()
+cache_ttl = {
+    "groups": 600,
+    "group_markets": 120,
+    "markets": 60,
+    "market": 30,
+    "balance": 30,
+    "user": 86400
+}
+store = None
+store_path = os.path.join(os.path.expanduser(
+    "~"), ".cache", "gpt_manifold", "snapshot.db")
+completion_cache = None
+completion_cache_path = os.path.join(os.path.expanduser(
+    "~"), ".cache", "gpt_manifold", "completions.db")
+completion_cache_ttl = 86400
+completion_cache_size = 10000
+completion_cache_volatile = [r'^The current date is .*$']
+journal = None
+journal_path = os.path.join(os.path.expanduser(
+    "~"), ".cache", "gpt_manifold", "journal.db")
+journal_concurrency = 8
+journal_max_age = 3600
+journal_slots = None
+reconcile_skew = 60000
+store_max_age = {
+    "groups": 3600,
+    "group_markets": 600
+}
 
 
 def init():
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if openai_key == None:
-        raise ValueError("Error: OPENAI_KEY environment variable not set")
-    openai.api_key = openai_key
+    init_clients()
+    start_journal_drain()
+    choose_model()
+    choose_max_bet()
+    choose_navigation()
+
+
+def init_clients(completions=True):
+    from .client import ManifoldClient
+    if (completions):
+        init_openai()
     global manifold_key
     manifold_key = os.getenv("MANIFOLD_API_KEY")
     if manifold_key == None:
         raise ValueError("Error: MANIFOLD_KEY environment variable not set")
-    choose_model()
-    choose_max_bet()
-    choose_navigation()
+    global client, store, completion_cache, scheduler, hydrator, rank_query
+    scheduler = Scheduler(rate_limits)
+    hydrator = Hydrator(lambda market_id: get_market_data(
+        market_id), hydrate_concurrency)
+    client = ManifoldClient(manifold_key, os.getenv("MANIFOLD_API_URL", manifold_url), pool_size=max(
+        client_pool_size, batch_concurrency), scheduler=scheduler)
+    store = SnapshotStore(os.getenv("GPT_MANIFOLD_STORE", store_path))
+    rank_query = os.getenv("GPT_MANIFOLD_RANK_QUERY", rank_query)
+    global journal, journal_slots
+    journal = Journal(os.getenv("GPT_MANIFOLD_JOURNAL", journal_path))
+    journal_slots = threading.BoundedSemaphore(journal_concurrency)
+    completion_cache = CompletionCache(os.getenv("GPT_MANIFOLD_COMPLETIONS", completion_cache_path),
+                                       completion_cache_ttl, completion_cache_size, completion_cache_volatile)
+    global metrics_server
+    if metrics_port and metrics_server is None:
+        metrics_server = serve_metrics(metrics_port)
+
+
+def init_openai():
+    global openai_key
+    openai_key = os.getenv("OPENAI_API_KEY")
+    if openai_key == None:
+        raise ValueError("Error: OPENAI_KEY environment variable not set")
+
+
+def get_completion_retry_errors():
+    return (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+            openai.error.APIConnectionError, openai.error.ServiceUnavailableError, openai.error.TryAgain)
 
 
 def choose_model():
-    options = ["gpt-3.5-turbo", "gpt-4"]
-    option, _index = pick(options, "Select model to use:")
-    global model
-    model = option
+    options = ["gpt-3.5-turbo", "gpt-4", "Ensemble: gpt-3.5-turbo + gpt-4"]
+    option, index = pick(options, "Select model to use:")
+    global model, ensemble_models
+    if index == 2:
+        model = "gpt-4"
+        ensemble_models = ["gpt-3.5-turbo", "gpt-4"]
+    else:
+        model = option
+        ensemble_models = []
 
 
 def choose_max_bet():
@@ -51,7 +180,7 @@ def choose_max_bet():
 
 def choose_navigation():
     options = ["Recent Markets", "Market Groups",
-               "Market URL", "Autonomous Bet", "Exit"]
+               "Market URL", "Autonomous Bet", "Autonomous Batch", "Exit"]
     _option, index = pick(options, "Select navigation mode:")
     if index == 0:
         show_markets()
@@ -62,6 +191,8 @@ def choose_navigation():
     elif index == 3:
         choose_auto_bet()
     elif index == 4:
+        choose_auto_batch()
+    elif index == 5:
         exit()
 
 
@@ -69,22 +200,52 @@ def choose_auto_bet():
     options = ["Yes, but ask me for confirmation before betting.", "Yes, bet automatically but don't post a comment.",
                "Yes, bet automatically and post a comment, too!", "No, take me back."]
     _option, index = pick(options, auto_bet_info.format(
-        model=model, group_pool_size=group_pool_size))
-    if index == 0:
-        prompt_for_group(False, False)
-    elif index == 1:
-        prompt_for_group(True, False)
-    elif index == 2:
-        prompt_for_group(True, True)
-    elif index == 3:
+        model=model, shortlist_size=shortlist_size))
+    if index == 3:
         choose_navigation()
+        return
+    selections = [f"Ask {model} to choose from a ranked shortlist",
+                  "Choose from the ranked shortlist locally (fast)"]
+    _option, selection = pick(
+        selections, "Select how groups and markets are chosen:")
+    global fast_selection
+    fast_selection = selection == 1
+    prompt_for_group(index > 0, index == 2)
+
+
+def choose_auto_batch():
+    options = ["Yes, bet automatically but don't post comments.",
+               "Yes, bet automatically and post comments, too!", "No, take me back."]
+    _option, index = pick(options, auto_batch_info.format(
+        model=model, batch_size=batch_size, batch_concurrency=batch_concurrency))
+    if index == 2:
+        choose_navigation()
+        return
+    sources = ["Random recent markets", "New markets since the last sync",
+               "Watched markets whose probability or description changed"]
+    _option, source = pick(sources, "Select markets to evaluate:")
+    global allocate_bets
+    sizings = ["Bet the amounts chosen by the model as they arrive",
+               "Allocate the batch budget with fractional Kelly once all markets are evaluated"]
+    _option, sizing = pick(sizings, "Select how bets are sized:")
+    allocate_bets = sizing == 1
+    global pack_size
+    packings = ["Predict each market in its own completion",
+                f"Pack up to {menu_pack_size} markets into each completion"]
+    _option, packing = pick(packings, "Select how markets are sent to the model:")
+    pack_size = menu_pack_size if packing == 1 else 1
+    prompt_for_batch(index == 1, source == 1, source == 2)
 
 
 def get_all_groups():
-    update_balance()
+    return cache.get_or_set(("groups",), cache_ttl["groups"],
+                            lambda: [Group.from_json(group) for group in get_snapshot(
+                                "groups", "groups", store_max_age["groups"], fetch_all_groups)])
+
+
+def fetch_all_groups():
     print_status("Retrieving groups...")
-    url = f'https://manifold.markets/api/v0/groups'
-    response = requests.get(url)
+    response = client.get('/groups')
 
     if response.status_code == 200:
         data = response.json()
@@ -95,9 +256,14 @@ def get_all_groups():
 
 
 def get_group_markets(group_id):
+    return cache.get_or_set(("group_markets", group_id), cache_ttl["group_markets"],
+                            lambda: MarketColumns.from_json(get_snapshot("markets", f"group:{group_id}", store_max_age["group_markets"],
+                                                                         lambda: fetch_group_markets(group_id)), load_description))
+
+
+def fetch_group_markets(group_id):
     print_status("Retrieving markets for group...")
-    url = f'https://manifold.markets/api/v0/group/by-id/{group_id}/markets'
-    response = requests.get(url)
+    response = client.get(f'/group/by-id/{group_id}/markets')
 
     if response.status_code == 200:
         data = response.json()
@@ -108,11 +274,14 @@ def get_group_markets(group_id):
 
 
 def get_all_markets(before_id):
-    if (len(before_id) == 0):
-        update_balance()
+    return cache.get_or_set(("markets", before_id), cache_ttl["markets"],
+                            lambda: MarketColumns.from_json(fetch_all_markets(before_id), load_description))
+
+
+def fetch_all_markets(before_id):
     print_status("Retrieving markets...")
-    url = f'https://manifold.markets/api/v0/markets?limit={page_limit}&before={before_id}'
-    response = requests.get(url)
+    response = client.get(
+        '/markets', params={"limit": page_limit, "before": before_id})
 
     if response.status_code == 200:
         data = response.json()
@@ -128,12 +297,12 @@ def get_market_data_by_url(market_url):
     result = re.search(pattern, market_url)
     if result:
         market_slug = result.group(1)
-        url = f'https://manifold.markets/api/v0/slug/{market_slug}'
-        response = requests.get(url)
+        response = client.get(f'/slug/{market_slug}')
 
         if response.status_code == 200:
-            data = response.json()
-            return data
+            market = Market.from_json(response.json())
+            cache.set(("market", market.id), market, cache_ttl["market"])
+            return market
         else:
             raise RuntimeError(
                 f"Error: Unable to retrieve market data (status code: {response.status_code})")
@@ -143,9 +312,17 @@ def get_market_data_by_url(market_url):
 
 
 def get_market_data(market_id):
+    return cache.get_or_set(("market", market_id), cache_ttl["market"],
+                            lambda: Market.from_json(fetch_market_data(market_id)))
+
+
+def load_description(market_id):
+    return get_market_data(market_id).description
+
+
+def fetch_market_data(market_id):
     print_status("Retrieving market data...")
-    url = f'https://manifold.markets/api/v0/market/{market_id}'
-    response = requests.get(url)
+    response = client.get(f'/market/{market_id}')
 
     if response.status_code == 200:
         data = response.json()
@@ -155,85 +332,339 @@ def get_market_data(market_id):
             f"Error: Unable to retrieve market data (status code: {response.status_code})")
 
 
+def fetch_market_bets(market_id, user_id=None, limit=1000, before_id=None):
+    print_status("Retrieving bets...")
+    params = {"contractId": market_id, "limit": limit}
+    if user_id is not None:
+        params["userId"] = user_id
+    if before_id is not None:
+        params["before"] = before_id
+    response = client.get('/bets', params=params)
+
+    if response.status_code == 200:
+        data = response.json()
+        return data
+    else:
+        raise RuntimeError(
+            f"Error: Unable to retrieve bets (status code: {response.status_code})")
+
+
+def get_snapshot(table, key, max_age, fetch):
+    data = store.get_listing(table, key, max_age)
+    if data is None:
+        data = fetch()
+        store.put_listing(table, key, data)
+    return data
+
+
 def update_balance():
+    global balance
+    balance = cache.get_or_set(
+        ("balance",), cache_ttl["balance"], fetch_balance)
+
+
+def fetch_balance():
     print_status("Updating current balance...")
-    url = f'https://manifold.markets/api/v0/me'
-    headers = {
-        "Authorization": f"Key {manifold_key}"
-    }
-    response = requests.get(url, headers=headers)
+    response = client.get('/me')
 
     if response.status_code == 200:
-        global balance
-        balance = int(response.json()["balance"])
+        return int(response.json()["balance"])
     else:
         raise RuntimeError(
             f"Error: Unable to get own profile (status code: {response.status_code}): {response.json()}")
 
 
-def post_bet(market_id, bet_amount, bet_outcome):
+def get_user_id():
+    return cache.get_or_set(("user",), cache_ttl["user"], fetch_user_id)
+
+
+def fetch_user_id():
+    response = client.get('/me')
+
+    if response.status_code == 200:
+        return response.json()["id"]
+    else:
+        raise RuntimeError(
+            f"Error: Unable to get own profile (status code: {response.status_code}): {response.json()}")
+
+
+def fetch_market_comments(market_id):
+    response = client.get('/comments', params={"contractId": market_id})
+
+    if response.status_code == 200:
+        data = response.json()
+        return data
+    else:
+        raise RuntimeError(
+            f"Error: Unable to retrieve comments (status code: {response.status_code})")
+
+
+def post_bet(market_id, bet_amount, bet_outcome, key=None):
+    with metrics.time("gpt_manifold_stage_seconds", stage="post_bet"):
+        return submit_action("bet", market_id, {"amount": int(bet_amount), "outcome": bet_outcome}, key)
+
+
+def submit_action(kind, market_id, payload, key=None):
+    if key is None:
+        # Within a session every market is bet on and commented on at most once
+        key = f"{log_session.session_id}:{kind}:{market_id}" if log_session.session_id else f"{kind}:{market_id}:{uuid.uuid4().hex}"
+    journal.enqueue(key, kind, market_id, payload)
+    return process_action(key)
+
+
+def process_action(key):
+    while True:
+        entry = journal.get(key)
+        if entry is not None and entry.state == "pending" and entry.attempts > 0:
+            # Manifold can list an ambiguously failed write only after a while, so wait before reconciling
+            time.sleep(scheduler.delay(entry.attempts, 0))
+        with journal_slots:
+            entry = journal.claim(key)
+            if entry is None:
+                entry = journal.get(key)
+                if entry.state == "done":
+                    return entry.result
+                raise RuntimeError(
+                    f"Error: {entry.kind} on market {entry.market_id} is {entry.state}: {entry.result}")
+            if entry.attempts > 1:
+                try:
+                    result = reconcile_action(entry)
+                except RuntimeError:
+                    journal.release(key)
+                    raise
+                if result is not None:
+                    metrics.increment(
+                        "gpt_manifold_journal_reconciled_total", kind=entry.kind)
+                    journal.finish(key, "done", result)
+                    return result
+            try:
+                if entry.kind == "bet":
+                    result = submit_bet(
+                        entry.market_id, entry.payload["amount"], entry.payload["outcome"])
+                else:
+                    result = submit_comment(
+                        entry.market_id, entry.payload["markdown"])
+            except UnknownOutcomeError:
+                metrics.increment(
+                    "gpt_manifold_journal_unknown_total", kind=entry.kind)
+                if journal.release(key) == "failed":
+                    raise
+                continue
+            except RuntimeError as error:
+                journal.finish(key, "failed", {"error": str(error)})
+                raise
+            journal.finish(key, "done", result)
+            return result
+
+
+def reconcile_action(entry):
+    since = entry.created * 1000 - reconcile_skew
+    user_id = get_user_id()
+    if entry.kind == "bet":
+        for bet in fetch_market_bets(entry.market_id, user_id, 100):
+            if (bet.get("createdTime", 0) >= since and bet.get("outcome") == entry.payload["outcome"]
+                    and round(bet.get("amount", 0)) == entry.payload["amount"]):
+                return {"betId": bet.get("id")}
+        return None
+    for comment in fetch_market_comments(entry.market_id):
+        if comment.get("userId") == user_id and comment.get("createdTime", 0) >= since:
+            return {"id": comment.get("id")}
+    return None
+
+
+def start_journal_drain():
+    journal.recover()
+    journal.expire(journal_max_age)
+    pending_keys = journal.pending_keys()
+    if pending_keys:
+        threading.Thread(target=drain_journal, args=(
+            pending_keys,), daemon=True).start()
+
+
+def drain_journal(keys):
+    with ThreadPoolExecutor(journal_concurrency) as executor:
+        futures = [executor.submit(process_action, key) for key in keys]
+    for key, future in zip(keys, futures):
+        if future.exception() is not None:
+            log_session.write_event(
+                "error", journal_key=key, error=str(future.exception()))
+
+
+def submit_bet(market_id, bet_amount, bet_outcome):
     print_status("Posting bet...")
-    url = f'https://manifold.markets/api/v0/bet'
     body = {
         "contractId": market_id,
         "amount": int(bet_amount),
         "outcome": bet_outcome
     }
-    headers = {
-        "Authorization": f"Key {manifold_key}"
-    }
-    response = requests.post(url, json=body, headers=headers)
+    response = client.post('/bet', body)
+    cache.invalidate(("balance",))
+    cache.invalidate(("market", market_id))
 
     if response.status_code == 200:
         return response.json()
+    elif response.status_code >= 500:
+        raise UnknownOutcomeError(
+            f"Error: Outcome of bet is unknown (status code: {response.status_code})")
     else:
         raise RuntimeError(
             f"Error: Unable to place bet (status code: {response.status_code}): {response.json()}")
 
 
-def post_comment(market_id, comment):
-    print_status("Posting comment...")
-    disclaimer_comment = disclaimer.format(model=model, comment=comment)
+def post_comment(market_id, comment, key=None):
+    with metrics.time("gpt_manifold_stage_seconds", stage="post_comment"):
+        disclaimer_comment = disclaimer.format(
+            model=get_model_name(), comment=comment)
+        return submit_action("comment", market_id, {"markdown": disclaimer_comment}, key)
+
 
-    url = f'https://manifold.markets/api/v0/comment'
+def submit_comment(market_id, markdown):
+    print_status("Posting comment...")
     body = {
         "contractId": market_id,
-        "markdown": disclaimer_comment,
-    }
-    headers = {
-        "Authorization": f"Key {manifold_key}"
+        "markdown": markdown,
     }
-    response = requests.post(url, json=body, headers=headers)
+    response = client.post('/comment', body)
 
     if response.status_code == 200:
         return response.json()
+    elif response.status_code >= 500:
+        raise UnknownOutcomeError(
+            f"Error: Outcome of comment is unknown (status code: {response.status_code})")
     else:
         raise RuntimeError(
             f"Error: Unable to post comment (status code: {response.status_code}): {response.json()}")
 
 
 def get_completion(messages):
+    started = time.monotonic()
+    answer = completion_cache.get(model, messages)
+    if answer is not None:
+        log_completion(model, messages, answer, started, True)
+        return answer
     print_status(f"Getting answer from {model}...")
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages
-    )
-    answer = response["choices"][0]["message"]["content"]
+    if (stream_completions):
+        response = scheduler.call("completion", lambda: openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            api_key=openai_key,
+            stream=True
+        ), get_completion_retry_errors())
+        answer = ""
+        for chunk in response:
+            content = chunk["choices"][0]["delta"].get("content", "")
+            answer += content
+            if not quiet:
+                print(content, end="", flush=True)
+    else:
+        response = scheduler.call("completion", lambda: openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            api_key=openai_key
+        ), get_completion_retry_errors())
+        answer = response["choices"][0]["message"]["content"]
+    completion_cache.set(model, messages, answer)
+    log_completion(model, messages, answer, started, False)
+    return answer
+
+
+async def get_completion_async(messages, on_decision=None, completion_model=None):
+    completion_model = completion_model or model
+    started = time.monotonic()
+    answer = completion_cache.get(completion_model, messages)
+    if answer is not None:
+        log_completion(completion_model, messages, answer, started, True)
+        return answer
+    if (stream_completions):
+        response = await scheduler.call_async("completion", lambda: openai.ChatCompletion.acreate(
+            model=completion_model,
+            messages=messages,
+            api_key=openai_key,
+            stream=True
+        ), get_completion_retry_errors())
+        tag_stream = TagStream()
+        async for chunk in response:
+            early = tag_stream.early
+            tag_stream.feed(chunk["choices"][0]["delta"].get("content", ""))
+            # Only a readable YES or NO is acted on early, the final answer still decides
+            if early is None and tag_stream.early is not None and on_decision:
+                on_decision(tag_stream.early)
+        answer = tag_stream.text
+    else:
+        response = await scheduler.call_async("completion", lambda: openai.ChatCompletion.acreate(
+            model=completion_model,
+            messages=messages,
+            api_key=openai_key
+        ), get_completion_retry_errors())
+        answer = response["choices"][0]["message"]["content"]
+    completion_cache.set(completion_model, messages, answer)
+    log_completion(completion_model, messages, answer, started, False)
     return answer
 
 
+def log_completion(completion_model, messages, answer, started, cached):
+    global log_session
+    latency = time.monotonic() - started
+    prompt_tokens = count_message_tokens(messages, completion_model)
+    completion_tokens = count_tokens(answer, completion_model)
+    log_session.write_event("completion", model=completion_model, prompt=messages, completion=answer,
+                            latency=latency, cached=cached, prompt_tokens=prompt_tokens,
+                            completion_tokens=completion_tokens)
+    metrics.increment("gpt_manifold_completions_total",
+                      model=completion_model, cached=cached)
+    if (cached):
+        return
+    prompt_price, completion_price = completion_prices.get(
+        completion_model, (0, 0))
+    metrics.observe("gpt_manifold_stage_seconds", latency,
+                    stage="completion", model=completion_model)
+    metrics.increment("gpt_manifold_tokens_total", prompt_tokens,
+                      model=completion_model, kind="prompt")
+    metrics.increment("gpt_manifold_tokens_total", completion_tokens,
+                      model=completion_model, kind="completion")
+    metrics.increment("gpt_manifold_cost_dollars_total", (prompt_tokens * prompt_price +
+                      completion_tokens * completion_price) / 1000, model=completion_model)
+
+
+async def predict_ensemble(data):
+    answers = await asyncio.gather(*[get_completion_async(
+        build_prediction_messages(data, member), None, member) for member in ensemble_models])
+    decisions = [parse_decision(answer) for answer in answers]
+    answer = "\n\n".join(f'{member} ({action} {amount}):\n\n{member_answer}' for member,
+                          member_answer, (action, amount) in zip(ensemble_models, answers, decisions))
+    return answer, aggregate_decisions(decisions)
+
+
+def aggregate_decisions(decisions):
+    if ensemble_weighting == "vote":
+        votes = {}
+        for action, amount in decisions:
+            votes.setdefault(action, []).append(amount)
+        ranked = sorted(votes.items(), key=lambda vote: len(vote[1]), reverse=True)
+        if (len(ranked) > 1 and len(ranked[0][1]) == len(ranked[1][1])) or ranked[0][0] not in ("YES", "NO"):
+            return abstain
+        return clamp_decision(Decision(ranked[0][0], sum(ranked[0][1]) // len(ranked[0][1])), max_bet, balance)
+    net = 0
+    for action, amount in decisions:
+        if action == "YES":
+            net += amount
+        elif action == "NO":
+            net -= amount
+    return clamp_decision(Decision("YES" if net > 0 else "NO", abs(net) // len(decisions)), max_bet, balance)
+
+
 def show_groups():
     data = get_all_groups()
     options = []
     options.append("Return to mode selection <-")
     for index, group in enumerate(data):
         options.append(
-            f'{index} - {group["name"]}: {group["totalContracts"]} markets')
+            f'{index} - {group.name}: {group.total_contracts} markets')
     _option, index = pick(options, "Select group you wish to view")
     if index == 0:
         choose_navigation()
     else:
-        show_group_markets(data[index - 1]["id"])
+        show_group_markets(data[index - 1].id)
 
 
 def show_group_markets(group_id):
@@ -242,12 +673,12 @@ def show_group_markets(group_id):
     options.append("Return to Groups <-")
     for index, market in enumerate(data):
         options.append(
-            f'{index} - {market["creatorName"]}: {market["question"]}')
+            f'{index} - {market.creator_name}: {market.question}')
     _option, index = pick(options, "Select market you wish to view")
     if index == 0:
         show_groups()
     else:
-        show_market_by_id(data[index - 1]["id"])
+        show_market_by_id(data[index - 1].id)
 
 
 def show_markets(before_id="", base_index=0):
@@ -256,15 +687,15 @@ def show_markets(before_id="", base_index=0):
     options.append("Return to mode selection <-")
     for index, market in enumerate(data):
         options.append(
-            f'{base_index + index} - {market["creatorName"]}: {market["question"]}')
+            f'{base_index + index} - {market.creator_name}: {market.question}')
     options.append("Next page ->")
     _option, index = pick(options, "Select market you wish to view")
     if index == 0:
         choose_navigation()
     elif index == len(options) - 1:
-        show_markets(data[index - 2]["id"], base_index + index - 1)
+        show_markets(data[index - 2].id, base_index + index - 1)
     else:
-        show_market_by_id(data[index - 1]["id"])
+        show_market_by_id(data[index - 1].id)
 
 
 def show_market_by_url(market_url):
@@ -281,9 +712,10 @@ def show_market(data):
     options = ["Yes", "No"]
     index = 0
     _option, index = pick(
-        options, wrap_string(f'Question: {data["question"]}\n\nDescription: {data["textDescription"]}\n\nCurrent probability: {format_probability(data["probability"])}\n\n - Do you want GPT-Manifold to make a prediction?'))
+        options, wrap_string(f'Question: {data.question}\n\nDescription: {data.description}\n\nCurrent probability: {format_probability(data.probability)}\n\n - Do you want GPT-Manifold to make a prediction?'))
     if index == 0:
-        prompt_for_prediction(data["id"])
+        init_openai()
+        prompt_for_prediction(data.id)
     else:
         choose_navigation()
 
@@ -295,30 +727,24 @@ def show_market_url_input():
 
 def prompt_for_prediction(market_id, auto_bet=False, auto_comment=False):
     global log_session
+    update_balance()
     data = get_market_data(market_id)
-    title = data["question"]
-    description = data["textDescription"]
-    probability = format_probability(data["probability"])
-
-    user_prompt = user_template.format(
-        title=title, description=description, probability=probability, play_money=balance)
-    date = datetime.datetime.now()
-    system_prompt = system_template.format(
-        character=get_character(), date=date, max_bet=max_bet)
-
-    log_session.write_message('BET PROMPT', system_prompt)
-    log_session.write_message('BET INFO', user_prompt)
+    title = data.question
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
-    answer = get_completion(messages)
+    if (ensemble_models):
+        print_status(f"Getting answers from {get_model_name()}...")
+        answer, (action, amount) = asyncio.get_event_loop(
+        ).run_until_complete(predict_ensemble(data))
+    else:
+        messages = build_prediction_messages(data)
+        answer = get_completion(messages)
+        action, amount = parse_decision(answer)
     log_session.write_message('PREDICTION', answer)
+    log_session.write_event("prediction", market_id=market_id, model=get_model_name(),
+                            probability=data.probability, action=action, amount=amount)
+    store.put_watch_entry(watch_entry(
+        data, Decision(action, amount), scan_estimate(answer)))
 
-    last_tag = find_tags(answer)[-1]
-    action = last_tag[0]
-    amount = re.sub("[^0-9]", "", last_tag[1])
     if (auto_bet):
         bet_pick = execute_action(market_id, action, amount, auto_comment)
         if (auto_comment):
@@ -337,6 +763,94 @@ def prompt_for_prediction(market_id, auto_bet=False, auto_comment=False):
             choose_navigation()
 
 
+def build_prediction_messages(data, prediction_model=None, date=None):
+    global log_session
+    prediction_model = prediction_model or model
+    date = date or datetime.datetime.now()
+    system_prompt = system_template.format(
+        character=get_character(prediction_model), date=date, max_bet=max_bet)
+    user_prompt = user_template.format(
+        title=data.question, description="",
+        probability=format_probability(data.probability), play_money=balance)
+    description = truncate(data.description, min(description_max_tokens, get_prompt_budget(
+        system_prompt, prediction_model) - count_tokens(user_prompt, prediction_model)), prediction_model)
+    user_prompt = user_template.format(
+        title=data.question, description=description,
+        probability=format_probability(data.probability), play_money=balance)
+
+    log_session.write_message('BET PROMPT', system_prompt)
+    log_session.write_message('BET INFO', user_prompt)
+
+    return build_messages(system_prompt, user_prompt, prediction_model)
+
+
+def build_batch_prediction_messages(datas):
+    global log_session
+    markets = "\n\n".join(format_batch_market(data) for data in datas)
+    user_prompt = user_template_batch.format(
+        markets=markets, play_money=balance)
+    date = datetime.datetime.now()
+    system_prompt = system_template_batch.format(
+        character=get_character(), date=date, max_bet=max_bet)
+
+    log_session.write_message('BATCH PROMPT', system_prompt)
+    log_session.write_message('BATCH INFO', user_prompt)
+
+    return build_messages(system_prompt, user_prompt)
+
+
+def format_batch_market(data):
+    return user_template_batch_market.format(
+        id=data.id, title=data.question,
+        description=truncate(data.description, description_max_tokens, model),
+        probability=format_probability(data.probability))
+
+
+def pack_markets(datas):
+    budget = min(pack_token_budget, get_prompt_budget(system_template_batch))
+    packs = []
+    pack = []
+    pack_tokens = 0
+    for data in datas:
+        tokens = count_tokens(format_batch_market(data), model)
+        if len(pack) > 0 and (len(pack) == pack_size or pack_tokens + tokens > budget):
+            packs.append(pack)
+            pack = []
+            pack_tokens = 0
+        pack.append(data)
+        pack_tokens += tokens
+    if len(pack) > 0:
+        packs.append(pack)
+    return packs
+
+
+def build_messages(system_prompt, user_prompt, prompt_model=None):
+    global log_session
+    prompt_model = prompt_model or model
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    tokens = count_message_tokens(messages, prompt_model)
+    budget = token_budgets.get(prompt_model, 4096) - completion_reserve
+    log_session.write_message('TOKENS', f'{tokens} prompt tokens of {budget} available')
+    if tokens > budget:
+        raise RuntimeError(
+            f"Error: Prompt of {tokens} tokens exceeds the budget of {budget} tokens for {prompt_model}")
+    return messages
+
+
+def get_prompt_budget(system_prompt, prompt_model=None):
+    prompt_model = prompt_model or model
+    budget = token_budgets.get(prompt_model, 4096) - completion_reserve
+    return max(budget - count_tokens(system_prompt, prompt_model) - 16, 0)
+
+
+def parse_decision(answer):
+    with metrics.time("gpt_manifold_stage_seconds", stage="parse_decision"):
+        return clamp_decision(scan_decision(answer), max_bet, balance)
+
+
 def execute_action(market_id, action, amount, auto_comment=False):
     if (action == "YES" or action == "NO"):
         place_bet(market_id, action, amount)
@@ -350,29 +864,30 @@ def prompt_for_group(auto_bet=False, auto_comment=False):
     log_session.start_session()
 
     data = get_all_groups()
-    random_groups = random.sample(data, group_pool_size)
-    group_list_string = ""
-    for group in random_groups:
-        if (group["totalContracts"] > 9):
-            group_list_string += f'{group["name"]}\n'
-
-    user_prompt = group_list_string
+    candidates = [group for group in data if group.total_contracts > 9]
+    ranked_groups = shortlist(candidates, [group.name for group in candidates])
+    if (fast_selection):
+        group = random.choice(ranked_groups[:fast_pool_size])
+        log_session.write_message('SELECTED GROUP', group.name)
+        prompt_for_market(group.id, auto_bet, auto_comment)
+        return
     date = datetime.datetime.now()
     system_prompt = system_template_groups.format(
         character=get_character(), date=date)
+    group_list_string = "\n".join(fit_lines([group.name for group in ranked_groups],
+                                            get_prompt_budget(system_prompt), model))
+
+    user_prompt = group_list_string
     log_session.write_message('GROUP PROMPT', system_prompt)
     log_session.write_message('GROUP LIST', group_list_string)
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
+    messages = build_messages(system_prompt, user_prompt)
     answer = get_completion(messages)
     log_session.write_message('SELECTED GROUP', answer)
 
-    for group in random_groups:
-        if group["name"] in answer:
-            prompt_for_market(group["id"], auto_bet, auto_comment)
+    for group in ranked_groups:
+        if group.name in answer:
+            prompt_for_market(group.id, auto_bet, auto_comment)
             return
     raise RuntimeError(
         f"Error: {model} was unable to pick a valid group: {answer}")
@@ -381,38 +896,287 @@ def prompt_for_group(auto_bet=False, auto_comment=False):
 def prompt_for_market(group_id, auto_bet=False, auto_comment=False):
     global log_session
     data = get_group_markets(group_id)
-    random_markets = random.sample(data, min(100, len(data)))
-    market_list_string = ""
-    for market in random_markets:
-        if (market["isResolved"] == False and "probability" in market):
-            market_list_string += f'{market["question"]}\n'
-
-    user_prompt = market_list_string
+    candidates = [market for market in data if market.is_open]
+    ranked_markets = shortlist(candidates, [
+        market.question for market in candidates])
+    if (fast_selection):
+        market = random.choice(ranked_markets[:fast_pool_size])
+        log_session.write_message('SELECTED MARKET', market.question)
+        prompt_for_prediction(market.id, auto_bet, auto_comment)
+        return
     date = datetime.datetime.now()
     system_prompt = system_template_markets.format(
         character=get_character(), date=date)
+    market_list_string = "\n".join(fit_lines([market.question for market in ranked_markets],
+                                             get_prompt_budget(system_prompt), model))
+
+    user_prompt = market_list_string
     log_session.write_message('MARKET PROMPT', system_prompt)
     log_session.write_message('MARKET LIST', market_list_string)
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
+    messages = build_messages(system_prompt, user_prompt)
     answer = get_completion(messages)
     log_session.write_message('SELECTED MARKET', answer)
-    for market in random_markets:
-        if market["question"] in answer:
-            prompt_for_prediction(market["id"], auto_bet, auto_comment)
+    for market in ranked_markets:
+        if market.question in answer:
+            prompt_for_prediction(market.id, auto_bet, auto_comment)
             return
     raise RuntimeError(
         f"Error: {model} was unable to pick a valid market: {answer}")
 
 
+def shortlist(candidates, texts):
+    from .ranking import rank
+    if len(candidates) == 0:
+        raise RuntimeError("Error: No candidates available to choose from")
+    return [candidates[index] for index in rank(texts, rank_query, shortlist_size, rank_temperature)]
+
+
+def prompt_for_batch(auto_comment=False, new_only=False, watched=False):
+    global log_session, quiet
+    log_session = LogSession()
+    log_session.start_session()
+    try:
+        update_balance()
+        if (watched):
+            market_ids = [market.id for market in get_drifted_markets(batch_size)]
+        elif (new_only):
+            market_ids = (market.id for market in itertools.islice(
+                (market for market in sync_markets() if market.is_open), batch_size))
+        else:
+            market_ids = get_open_market_ids(batch_size)
+        log_session.write_message(
+            'BATCH', f'Evaluating up to {batch_size} markets with {batch_concurrency} concurrent workers')
+        quiet = True
+        asyncio.get_event_loop().run_until_complete(
+            predict_markets(market_ids, auto_comment, allocate_bets))
+    finally:
+        quiet = False
+        log_session.end_session()
+    print(metrics.report())
+
+
+def get_open_market_ids(count):
+    market_ids = []
+    before_id = ""
+    while len(market_ids) < count:
+        data = get_all_markets(before_id)
+        if len(data) == 0:
+            break
+        entries = store.find_watch_entries(market.id for market in data)
+        for market in data:
+            entry = entries.get(market.id)
+            if market.is_open and (entry is None or has_moved(entry, market, drift_threshold)):
+                market_ids.append(market.id)
+        before_id = data[-1].id
+    random.shuffle(market_ids)
+    return market_ids[:count]
+
+
+def get_drifted_markets(count):
+    entries = store.get_watch_entries(watch_poll_size)
+    for entry in entries:
+        cache.invalidate(("market", entry.market_id))
+    with metrics.time("gpt_manifold_stage_seconds", stage="watch_poll"):
+        markets = hydrator.hydrate(
+            [entry.market_id for entry in entries], return_exceptions=True)
+    drifted, closed = find_drifted(entries, markets, drift_threshold)
+    store.touch_watch_entries(entry.market_id for entry in entries)
+    store.remove_watch_entries(closed)
+    metrics.increment("gpt_manifold_watch_drifted_total", len(drifted))
+    log_session.write_message(
+        'WATCHLIST', f'{len(drifted)} of {len(entries)} watched markets drifted, {len(closed)} closed')
+    return drifted[:count]
+
+
+def sync_markets(max_pages=None):
+    if max_pages is None:
+        max_pages = sync_max_pages
+    return (Market.from_json(market, load_description) for market in
+            FeedSync(fetch_all_markets, store, page_limit, max_pages).iter_new())
+
+
+async def predict_markets(market_ids, auto_comment=False, allocate=False):
+    global log_session
+    semaphore = asyncio.Semaphore(batch_concurrency)
+    results = asyncio.Queue()
+    loop = asyncio.get_event_loop()
+
+    async def predict(chunk):
+        async with semaphore:
+            reported = set()
+            try:
+                datas = list((await hydrator.hydrate_async(chunk)).values())
+                for pack in pack_markets(datas):
+                    if len(pack) == 1 and ensemble_models:
+                        data = pack[0]
+                        answer, decision = await predict_ensemble(data)
+                        answers = {data.id: (answer, decision)}
+                    elif len(pack) == 1:
+                        data = pack[0]
+                        messages = build_prediction_messages(data)
+                        answer = await get_completion_async(
+                            messages, lambda decision: results.put_nowait(("decision", data, decision)))
+                        answers = {data.id: (answer, parse_decision(answer))}
+                    else:
+                        messages = build_batch_prediction_messages(pack)
+                        answers = {market_id: (answer, parse_decision(answer)) for market_id, answer
+                                   in find_market_tags(await get_completion_async(messages)).items()}
+                    for data in pack:
+                        reported.add(data.id)
+                        if data.id in answers:
+                            await results.put(("answer", data, answers[data.id]))
+                        else:
+                            await results.put(("error", data, RuntimeError(
+                                f"Error: {model} returned no result for market {data.id}")))
+            except Exception as error:
+                for market_id in chunk:
+                    if market_id not in reported:
+                        await results.put(("error", None, error))
+
+    async def schedule():
+        iterator = iter(market_ids)
+        count = 0
+        chunk = []
+        scheduled = set()
+        try:
+            while True:
+                try:
+                    market_id = await loop.run_in_executor(None, next, iterator, None)
+                except Exception as error:
+                    await results.put(("error", None, error))
+                    count += 1
+                    market_id = None
+                if market_id in scheduled:
+                    continue
+                if market_id is not None:
+                    scheduled.add(market_id)
+                    chunk.append(market_id)
+                    hydrator.submit(market_id)
+                if len(chunk) > 0 and (market_id is None or len(chunk) == pack_size):
+                    asyncio.ensure_future(predict(chunk))
+                    count += len(chunk)
+                    chunk = []
+                if market_id is None:
+                    break
+        finally:
+            await results.put(("total", None, count))
+
+    asyncio.ensure_future(schedule())
+    decisions = {}
+    predictions = {}
+    bets = {}
+    reports = []
+    total = None
+    index = 0
+
+    async def report(data, answer, index):
+        # Bets run concurrently, so each market is reported once its own bet has settled
+        action, amount, bet = bets[data.id]
+        try:
+            bet_pick = await bet
+        except Exception as error:
+            bet_pick = f"Bet failed: {error} "
+            log_session.write_event("error", market_id=data.id, error=str(error))
+        try:
+            if (auto_comment):
+                await loop.run_in_executor(
+                    None, post_comment, data.id, answer)
+                log_session.write_message(
+                    'COMMENT', f'Comment posted: {data.id}\n\n{answer}')
+                log_session.write_event(
+                    "comment", market_id=data.id, comment=answer)
+        except Exception as error:
+            log_session.write_event("error", market_id=data.id, error=str(error))
+            bet_pick += f"Comment failed: {error} "
+        print(f'[{index}] {action} {amount} - {data.question}: {bet_pick}')
+
+    while total is None or index < total:
+        event, data, value = await results.get()
+        if event == "total":
+            total = value
+            continue
+        if event != "decision":
+            index += 1
+        try:
+            if event == "error":
+                raise value
+            if event == "decision":
+                if data.id not in decisions:
+                    decisions[data.id] = clamp_decision(value, max_bet, balance)
+                    if not allocate:
+                        bets[data.id] = (*decisions[data.id], loop.run_in_executor(
+                            None, execute_action, data.id, *decisions[data.id]))
+                continue
+            answer, decision = value
+            action, amount = decision
+            early = decisions.get(data.id)
+            if early is not None and early != decision:
+                log_session.write_message(
+                    'DECISION CHANGED', f'{data.id}: {early.action} {early.amount} acted on early, {action} {amount} in the final answer')
+                log_session.write_event("decision_changed", market_id=data.id, early_action=early.action,
+                                        early_amount=early.amount, action=action, amount=amount)
+            if not allocate and data.id not in bets:
+                bets[data.id] = (action, amount, loop.run_in_executor(
+                    None, execute_action, data.id, action, amount))
+            estimate = scan_estimate(answer)
+            log_session.write_message('PREDICTION', answer)
+            log_session.write_event("prediction", market_id=data.id, model=get_model_name(),
+                                    probability=data.probability, estimate=estimate, action=action, amount=amount)
+            store.put_watch_entry(watch_entry(data, decision, estimate))
+            if allocate:
+                predictions[data.id] = (data, decision, estimate, answer)
+                print(f'[{index}] {action} {amount} - {data.question}: Queued for allocation. ')
+            else:
+                reports.append(asyncio.ensure_future(
+                    report(data, answer, index)))
+        except Exception as error:
+            log_session.write_message('ERROR', str(error))
+            log_session.write_event(
+                "error", market_id=data.id if data else None, error=str(error))
+            print(f'[{index}] {error}')
+    await asyncio.gather(*reports)
+    if allocate:
+        await loop.run_in_executor(None, execute_allocation, list(predictions.values()), auto_comment)
+
+
+def execute_allocation(predictions, auto_comment=False):
+    global balance
+    budget = balance if allocation_budget is None else min(allocation_budget, balance)
+    with metrics.time("gpt_manifold_stage_seconds", stage="allocate"):
+        allocations = allocate([(data.id, data.probability, decision, estimate) for data, decision, estimate, _answer in predictions],
+                               balance, budget, max_bet, kelly_multiplier)
+    log_session.write_message('ALLOCATION', "\n".join(
+        f'{allocation.market_id}: {allocation.action} {allocation.amount} (edge {allocation.edge:.3f})' for allocation in allocations))
+    answers = {data.id: (data, answer) for data, _decision, _estimate, answer in predictions}
+    for index, allocation in enumerate(allocations, 1):
+        data, answer = answers[allocation.market_id]
+        try:
+            place_bet(allocation.market_id, allocation.action, allocation.amount)
+            balance -= allocation.amount
+            bet_pick = "Bet successfully placed! "
+            if (auto_comment):
+                post_comment(allocation.market_id, answer)
+                log_session.write_message(
+                    'COMMENT', f'Comment posted: {allocation.market_id}\n\n{answer}')
+                log_session.write_event(
+                    "comment", market_id=allocation.market_id, comment=answer)
+        except RuntimeError as error:
+            bet_pick = f"Bet failed: {error} "
+            log_session.write_event(
+                "error", market_id=allocation.market_id, error=str(error))
+        print(
+            f'[allocation {index}/{len(allocations)}] {allocation.action} {allocation.amount} - {data.question}: {bet_pick}')
+    return allocations
+
+
 def place_bet(market_id, bet_outcome, bet_amount):
     global log_session
-    post_bet(market_id, bet_amount, bet_outcome)
+    bet = post_bet(market_id, bet_amount, bet_outcome)
     log_session.write_message(
         'BET', f'Bet placed: {market_id}\n\n{bet_outcome} - {bet_amount}')
+    log_session.write_event("bet", market_id=market_id, bet_id=bet.get("betId"),
+                            outcome=bet_outcome, amount=bet_amount)
 
 
 def place_comment(market_id, comment, bet_pick, auto_comment=False):
@@ -421,6 +1185,8 @@ def place_comment(market_id, comment, bet_pick, auto_comment=False):
         post_comment(market_id, comment)
         log_session.write_message(
             'COMMENT', f'Comment posted: {market_id}\n\n{comment}')
+        log_session.write_event(
+            "comment", market_id=market_id, comment=comment)
         log_session.end_session()
         exit()
     else:
@@ -431,6 +1197,8 @@ def place_comment(market_id, comment, bet_pick, auto_comment=False):
         if index == 0:
             next_pick = "Comment successfully posted!"
             post_comment(market_id, comment)
+            log_session.write_event(
+                "comment", market_id=market_id, comment=comment)
         _option, index = pick(
             options, wrap_string(f'{next_pick} Would you like to view other markets?'))
         if index == 0:
@@ -439,30 +1207,20 @@ def place_comment(market_id, comment, bet_pick, auto_comment=False):
             exit()
 
 
-def find_tags(text):
-    tag_pattern = re.compile(r'<(\w+)[^>]*>(.*?)<\/\1>|<(\w+)\/>')
-    matches = tag_pattern.findall(text)
-    parsed_tags = []
-    for match in matches:
-        if match[0]:
-            tag_name = match[0]
-            content = match[1]
-        else:
-            tag_name = match[2]
-            content = "0"
-        parsed_tags.append((tag_name, content))
-    if len(parsed_tags) == 0:
-        parsed_tags.append("ABSTAIN", "0")
-    return parsed_tags
-
-
-def get_character():
-    if model == "gpt-4":
+def get_character(character_model=None):
+    character_model = character_model or model
+    if character_model == "gpt-4":
         return gpt_4_character
-    elif model == "gpt-3.5-turbo":
+    elif character_model == "gpt-3.5-turbo":
         return chat_gpt_character
 
 
+def get_model_name():
+    if (ensemble_models):
+        return " + ".join(ensemble_models)
+    return model
+
+
 def format_probability(probability):
     return f'{round(probability * 100, 2)}%'
 
@@ -474,7 +1232,14 @@ def wrap_string(text):
     return output
 
 
+def pick(options, title):
+    from pick import pick as pick_option
+    return pick_option(options, title)
+
+
 def print_status(text):
+    if quiet:
+        return
     cls()
     print(text)
 
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Hydrator:
+    def __init__(self, fetch, concurrency=8):
+        self.fetch = fetch
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key):
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(self.fetch, key)
+            self.inflight[key] = future
+        # A finished future runs the callback inline, so it must be added without holding the lock
+        future.add_done_callback(lambda _: self.forget(key, future))
+        return future
+
+    def forget(self, key, future):
+        with self.lock:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def hydrate(self, keys, return_exceptions=False):
+        futures = OrderedDict((key, self.submit(key))
+                              for key in dict.fromkeys(keys))
+        results = OrderedDict()
+        for key, future in futures.items():
+            if return_exceptions and future.exception() is not None:
+                results[key] = future.exception()
+            else:
+                results[key] = future.result()
+        return results
+
+    async def hydrate_async(self, keys, return_exceptions=False):
+        futures = OrderedDict((key, asyncio.wrap_future(self.submit(key)))
+                              for key in dict.fromkeys(keys))
+        values = await asyncio.gather(*futures.values(), return_exceptions=return_exceptions)
+        return OrderedDict(zip(futures.keys(), values))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
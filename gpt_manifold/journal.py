@@ -0,0 +1,103 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+
+class UnknownOutcomeError(RuntimeError):
+    pass
+
+
+class JournalEntry(NamedTuple):
+    key: str
+    kind: str
+    market_id: str
+    payload: dict
+    state: str
+    attempts: int
+    result: Optional[dict]
+    created: float
+
+
+class Journal:
+    def __init__(self, path, max_attempts=5):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=FULL;
+                CREATE TABLE IF NOT EXISTS actions (key TEXT PRIMARY KEY, kind TEXT, market_id TEXT, payload TEXT,
+                                                    state TEXT, attempts INTEGER, result TEXT, created REAL, updated REAL);
+                CREATE INDEX IF NOT EXISTS actions_state ON actions (state, created);
+            """)
+
+    def enqueue(self, key, kind, market_id, payload):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO actions (key, kind, market_id, payload, state, attempts, result, created, updated) "
+                "VALUES (?, ?, ?, ?, 'pending', 0, NULL, ?, ?)", (key, kind, market_id, json.dumps(payload), now, now))
+        return self.get(key)
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT key, kind, market_id, payload, state, attempts, result, created FROM actions WHERE key = ?",
+                (key,)).fetchone()
+        return None if row is None else read_entry(row)
+
+    def claim(self, key):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE actions SET state = 'inflight', attempts = attempts + 1, updated = ? "
+                "WHERE key = ? AND state = 'pending'", (time.time(), key))
+        if cursor.rowcount == 0:
+            return None
+        return self.get(key)
+
+    def finish(self, key, state, result=None):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE actions SET state = ?, result = ?, updated = ? WHERE key = ?",
+                                    (state, json.dumps(result), time.time(), key))
+
+    def release(self, key):
+        entry = self.get(key)
+        state = "failed" if entry.attempts >= self.max_attempts else "pending"
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE actions SET state = ?, updated = ? WHERE key = ?",
+                                    (state, time.time(), key))
+        return state
+
+    def recover(self):
+        # Entries left inflight by a crash may or may not have reached Manifold
+        with self.lock, self.connection:
+            return self.connection.execute(
+                "UPDATE actions SET state = 'pending', updated = ? WHERE state = 'inflight'", (time.time(),)).rowcount
+
+    def expire(self, max_age):
+        with self.lock, self.connection:
+            return self.connection.execute("UPDATE actions SET state = 'expired', updated = ? WHERE state = 'pending' AND created < ?",
+                                           (time.time(), time.time() - max_age)).rowcount
+
+    def pending_keys(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key FROM actions WHERE state = 'pending' ORDER BY created").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def read_entry(row):
+    key, kind, market_id, payload, state, attempts, result, created = row
+    return JournalEntry(key, kind, market_id, json.loads(payload), state, attempts,
+                        None if result is None else json.loads(result), created)
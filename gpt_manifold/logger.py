@@ -1,31 +1,144 @@
+import itertools
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 
+log_path = os.path.join(os.path.expanduser(
+    "~"), ".cache", "gpt_manifold", "logs", "gpt_manifold.jsonl")
+session_ids = itertools.count()
+# Every session of the process appends to the same rotated files, tagged with its own id
+logger = logging.getLogger("gpt_manifold.session")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+shared_lock = threading.Lock()
+shared_sessions = 0
+shared_handler = None
+shared_events = None
+
+
+def open_shared(path, structured, max_bytes, backups):
+    global shared_sessions, shared_handler, shared_events
+    with shared_lock:
+        if shared_sessions == 0:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            shared_handler = logging.handlers.RotatingFileHandler(os.path.splitext(path)[0] + ".log",
+                                                                  maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            shared_handler.setFormatter(logging.Formatter('%(asctime)s - %(session)s - %(levelname)s - %(message)s',
+                                                          datefmt='%Y-%m-%d %H:%M:%S'))
+            logger.addHandler(shared_handler)
+            if structured:
+                shared_events = JsonLogWriter(path, max_bytes, backups)
+        shared_sessions += 1
+        return shared_events
+
+
+def close_shared():
+    global shared_sessions, shared_handler, shared_events
+    with shared_lock:
+        shared_sessions -= 1
+        if shared_sessions > 0:
+            return
+        logger.removeHandler(shared_handler)
+        shared_handler.close()
+        shared_handler = None
+        if shared_events is not None:
+            shared_events.close()
+            shared_events = None
+
 
 class LogSession:
-    def __init__(self):
-        self.logfile = None
-        self.logger = None
+    def __init__(self, structured=True, max_bytes=50 * 1024 * 1024, backups=5, path=None):
+        self.path = path
+        self.structured = structured
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.active = False
+        self.events = None
+        self.session_id = None
 
     def start_session(self):
+        if self.active:
+            return
         date_str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        log_filename = f"gpt_manifold_{date_str}.log"
-        self.logfile = os.path.join(os.getcwd(), log_filename)
-
-        logging.basicConfig(filename=self.logfile, level=logging.INFO,
-                            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                            datefmt='%Y-%m-%d %H:%M:%S')
-        self.logger = logging.getLogger('Log Session')
+        self.session_id = f"{date_str}_{os.getpid()}_{next(session_ids)}"
+        self.events = open_shared(self.path or os.getenv("GPT_MANIFOLD_LOG", log_path),
+                                  self.structured, self.max_bytes, self.backups)
+        self.active = True
 
     def write_message(self, tag, message):
-        if self.logger is None:
+        if not self.active:
             return
-        self.logger.info(f"[{tag}]\n\n{message}\n\n")
+        logger.info(f"[{tag}]\n\n{message}\n\n",
+                    extra={"session": self.session_id})
+
+    def write_event(self, event, **fields):
+        if not self.active or self.events is None:
+            return
+        self.events.write(
+            {"time": time.time(), "session": self.session_id, "event": event, **fields})
 
     def end_session(self):
-        if self.logger is None:
+        if not self.active:
             return
+        self.active = False
+        self.events = None
+        close_shared()
+
+
+class JsonLogWriter:
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backups=5, flush_interval=1.0, batch_size=256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        self.queue.put(record)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        file = open(self.path, "a", encoding="utf-8")
+        closing = False
+        while not closing:
+            try:
+                records = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = None in records
+            lines = "".join(json.dumps(record, default=str) + "\n"
+                            for record in records if record is not None)
+            if file.tell() > 0 and file.tell() + len(lines) > self.max_bytes:
+                file.close()
+                self.rotate()
+                file = open(self.path, "a", encoding="utf-8")
+            file.write(lines)
+            file.flush()
+        file.close()
 
-        logging.shutdown()
-        self.logger = None
+    def rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
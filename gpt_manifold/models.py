@@ -0,0 +1,98 @@
+import sys
+from array import array
+
+missing_probability = -1.0
+
+
+class Market:
+    __slots__ = ("id", "question", "probability", "is_resolved",
+                 "creator_name", "slug", "_description", "loader")
+
+    def __init__(self, id, question, probability=None, is_resolved=False, creator_name="", slug="", description=None, loader=None):
+        self.id = id
+        self.question = question
+        self.probability = probability
+        self.is_resolved = is_resolved
+        self.creator_name = creator_name
+        self.slug = slug
+        self._description = description
+        self.loader = loader
+
+    @classmethod
+    def from_json(cls, data, loader=None):
+        return cls(data["id"], data["question"], data.get("probability"), data.get("isResolved", False),
+                   sys.intern(data.get("creatorName", "")), data.get("slug", ""),
+                   data.get("textDescription"), loader)
+
+    @property
+    def description(self):
+        if self._description is None and self.loader is not None:
+            self._description = self.loader(self.id)
+        return self._description or ""
+
+    @property
+    def is_open(self):
+        return not self.is_resolved and self.probability is not None
+
+    def to_json(self):
+        data = {"id": self.id, "question": self.question, "isResolved": self.is_resolved,
+                "creatorName": self.creator_name, "slug": self.slug}
+        if self.probability is not None:
+            data["probability"] = self.probability
+        if self._description is not None:
+            data["textDescription"] = self._description
+        return data
+
+
+class Group:
+    __slots__ = ("id", "name", "total_contracts")
+
+    def __init__(self, id, name, total_contracts=0):
+        self.id = id
+        self.name = name
+        self.total_contracts = total_contracts
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["id"], data["name"], data.get("totalContracts", 0))
+
+
+class MarketColumns:
+    def __init__(self, loader=None):
+        self.loader = loader
+        self.ids = []
+        self.questions = []
+        self.creator_names = []
+        self.probabilities = array("d")
+        self.resolved = array("b")
+
+    @classmethod
+    def from_json(cls, items, loader=None):
+        columns = cls(loader)
+        for data in items:
+            columns.append(data)
+        return columns
+
+    def append(self, data):
+        probability = data.get("probability")
+        self.ids.append(data["id"])
+        self.questions.append(data["question"])
+        self.creator_names.append(sys.intern(data.get("creatorName", "")))
+        self.probabilities.append(
+            missing_probability if probability is None else probability)
+        self.resolved.append(1 if data.get("isResolved", False) else 0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        probability = self.probabilities[index]
+        return Market(self.ids[index], self.questions[index],
+                      None if probability == missing_probability else probability,
+                      self.resolved[index] == 1, self.creator_names[index], loader=self.loader)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
@@ -0,0 +1,68 @@
+import re
+import zlib
+
+import numpy as np
+
+token_pattern = re.compile(r"[a-z0-9]+")
+
+
+class HashedIndex:
+    def __init__(self, texts, dimensions=2 ** 18):
+        self.dimensions = dimensions
+        doc_ids = []
+        indices = []
+        counts = []
+        for doc_id, text in enumerate(texts):
+            hashed = hash_tokens(text, dimensions)
+            unique, count = np.unique(hashed, return_counts=True)
+            doc_ids.append(np.full(len(unique), doc_id, dtype=np.int32))
+            indices.append(unique)
+            counts.append(count)
+        self.size = len(texts)
+        self.doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32)
+        self.indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate(counts) if counts else np.zeros(0)
+
+        features, frequency = np.unique(self.indices, return_counts=True)
+        self.idf = dict(zip(features.tolist(), (np.log(
+            (1 + self.size) / (1 + frequency)) + 1).tolist()))
+        idf = np.array([self.idf[index] for index in self.indices.tolist()])
+        values = (1 + np.log(counts)) * idf
+        norms = np.sqrt(np.bincount(self.doc_ids, weights=values ** 2,
+                                    minlength=self.size))
+        self.values = values / np.where(norms == 0, 1, norms)[self.doc_ids]
+
+    def query(self, text):
+        hashed = hash_tokens(text, self.dimensions)
+        unique, count = np.unique(hashed, return_counts=True)
+        weights = {}
+        for index, frequency in zip(unique.tolist(), count.tolist()):
+            if index in self.idf:
+                weights[index] = (1 + np.log(frequency)) * self.idf[index]
+        scores = np.zeros(self.size)
+        if len(weights) == 0:
+            return scores
+        keys = np.array(list(weights.keys()))
+        query = np.array(list(weights.values()))
+        query /= np.linalg.norm(query)
+        positions = np.searchsorted(keys, self.indices)
+        positions = np.minimum(positions, len(keys) - 1)
+        matches = keys[positions] == self.indices
+        np.add.at(scores, self.doc_ids[matches],
+                  self.values[matches] * query[positions[matches]])
+        return scores
+
+
+def hash_tokens(text, dimensions):
+    tokens = token_pattern.findall(text.lower())
+    return np.array([zlib.crc32(token.encode("utf-8")) % dimensions for token in tokens], dtype=np.int64)
+
+
+def rank(texts, query, count, temperature=0.0):
+    scores = HashedIndex(texts).query(query)
+    if temperature > 0:
+        # Gumbel noise samples the top candidates in proportion to exp(score / temperature)
+        scores = scores + temperature * \
+            np.random.default_rng().gumbel(size=len(scores))
+    order = np.argsort(-scores, kind="stable")
+    return order[:count].tolist()
@@ -0,0 +1,99 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate)
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self.reserve())
+
+
+class Scheduler:
+    def __init__(self, limits, retries=5, base_delay=1, max_delay=60):
+        self.buckets = {kind: TokenBucket(rate, capacity)
+                        for kind, (rate, capacity) in limits.items()}
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def call(self, kind, fn, retry_exceptions=(), retry_result=None):
+        attempt = 0
+        while True:
+            self.buckets[kind].acquire()
+            try:
+                result = fn()
+            except retry_exceptions as error:
+                if attempt >= self.retries:
+                    raise
+                retry_after = error_retry_after(error)
+            else:
+                retry_after = retry_result(result) if retry_result else None
+                if retry_after is None or attempt >= self.retries:
+                    return result
+            time.sleep(self.delay(attempt, retry_after))
+            attempt += 1
+
+    async def call_async(self, kind, fn, retry_exceptions=(), retry_result=None):
+        attempt = 0
+        while True:
+            await self.buckets[kind].acquire_async()
+            try:
+                result = await fn()
+            except retry_exceptions as error:
+                if attempt >= self.retries:
+                    raise
+                retry_after = error_retry_after(error)
+            else:
+                retry_after = retry_result(result) if retry_result else None
+                if retry_after is None or attempt >= self.retries:
+                    return result
+            await asyncio.sleep(self.delay(attempt, retry_after))
+            attempt += 1
+
+    def delay(self, attempt, retry_after):
+        if retry_after:
+            return min(retry_after, self.max_delay)
+        backoff = min(self.base_delay * 2 ** attempt, self.max_delay)
+        return random.uniform(backoff / 2, backoff)
+
+
+def error_retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    return parse_retry_after(headers.get("Retry-After"))
+
+
+def parse_retry_after(value):
+    if value is None:
+        return 0
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0
+    if date is None:
+        return 0
+    return max(date.timestamp() - time.time(), 0)
@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .watchlist import WatchEntry
+
+
+class SnapshotStore:
+    tables = ("groups", "markets")
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS groups (id TEXT PRIMARY KEY, data TEXT, updated REAL);
+                CREATE TABLE IF NOT EXISTS markets (id TEXT PRIMARY KEY, data TEXT, updated REAL);
+                CREATE TABLE IF NOT EXISTS listings (key TEXT PRIMARY KEY, ids TEXT, updated REAL);
+                CREATE TABLE IF NOT EXISTS feed (id TEXT PRIMARY KEY, seen REAL);
+                CREATE TABLE IF NOT EXISTS feed_backlog (id TEXT PRIMARY KEY, data TEXT, created REAL);
+                CREATE TABLE IF NOT EXISTS feed_cursor (key INTEGER PRIMARY KEY CHECK (key = 0), before_id TEXT);
+                CREATE TABLE IF NOT EXISTS watchlist (id TEXT PRIMARY KEY, action TEXT, amount INTEGER, probability REAL,
+                                                      estimate REAL, description_hash TEXT, updated REAL, checked REAL);
+            """)
+
+    def get_listing(self, table, key, max_age):
+        self.check_table(table)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT ids, updated FROM listings WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < time.time() - max_age:
+                return None
+            ids = json.loads(row[0])
+            rows = self.connection.execute(
+                f"SELECT id, data FROM {table} WHERE id IN (SELECT value FROM json_each(?))",
+                (row[0],)).fetchall()
+        items = {id: data for id, data in rows}
+        if len(items) != len(set(ids)):
+            return None
+        return [json.loads(items[id]) for id in ids]
+
+    def put_listing(self, table, key, items):
+        self.check_table(table)
+        now = time.time()
+        ids = [item["id"] for item in items]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {table} (id, data, updated) VALUES (?, ?, ?)",
+                [(item["id"], json.dumps(item), now) for item in items])
+            self.connection.execute(
+                "INSERT OR REPLACE INTO listings (key, ids, updated) VALUES (?, ?, ?)",
+                (key, json.dumps(ids), now))
+
+    def find_feed_markets(self, market_ids):
+        ids = json.dumps(list(market_ids))
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM feed WHERE id IN (SELECT value FROM json_each(?)) "
+                "UNION SELECT id FROM feed_backlog WHERE id IN (SELECT value FROM json_each(?))", (ids, ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def get_feed_backlog(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT data FROM feed_backlog ORDER BY created DESC").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_feed_cursor(self):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT before_id FROM feed_cursor WHERE key = 0").fetchone()
+        return None if row is None else row[0]
+
+    def add_feed_backlog(self, markets, cursor):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO feed_backlog (id, data, created) VALUES (?, ?, ?)",
+                [(market["id"], json.dumps(market), market.get("createdTime", 0)) for market in markets])
+            if cursor is None:
+                self.connection.execute("DELETE FROM feed_cursor")
+            else:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO feed_cursor (key, before_id) VALUES (0, ?)", (cursor,))
+
+    def add_feed_markets(self, markets):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO markets (id, data, updated) VALUES (?, ?, ?)",
+                [(market["id"], json.dumps(market), now) for market in markets])
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO feed (id, seen) VALUES (?, ?)",
+                [(market["id"], now) for market in markets])
+            self.connection.executemany(
+                "DELETE FROM feed_backlog WHERE id = ?", [(market["id"],) for market in markets])
+
+    def put_watch_entry(self, entry):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO watchlist (id, action, amount, probability, estimate, description_hash, updated, checked) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (*entry, entry.updated))
+
+    def get_watch_entries(self, limit=-1):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, action, amount, probability, estimate, description_hash, updated FROM watchlist "
+                "ORDER BY checked LIMIT ?", (limit,)).fetchall()
+        return [WatchEntry(*row) for row in rows]
+
+    def find_watch_entries(self, market_ids):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, action, amount, probability, estimate, description_hash, updated FROM watchlist "
+                "WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(list(market_ids)),)).fetchall()
+        return {row[0]: WatchEntry(*row) for row in rows}
+
+    def touch_watch_entries(self, market_ids):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE watchlist SET checked = ? WHERE id = ?", [(now, market_id) for market_id in market_ids])
+
+    def remove_watch_entries(self, market_ids):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM watchlist WHERE id = ?", [(market_id,) for market_id in market_ids])
+
+    def check_table(self, table):
+        if table not in self.tables:
+            raise ValueError(f"Error: Unknown snapshot table: {table}")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,24 @@
+from .decision import action_pattern, read_action
+
+
+class TagStream:
+    def __init__(self):
+        self.text = ""
+        self.position = 0
+        self.decision = None
+        self.early = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        while True:
+            match = action_pattern.search(self.text, self.position)
+            if match is None:
+                self.position = max(self.position, len(self.text) - 64)
+                break
+            decision = read_action(match)
+            if decision is not None:
+                self.decision = decision
+                if self.early is None and decision.action in ("YES", "NO"):
+                    self.early = decision
+            self.position = match.end()
+        return self.decision
@@ -0,0 +1,45 @@
+encodings = {}
+truncation_marker = " [...]"
+
+
+def get_encoding(model):
+    if model not in encodings:
+        try:
+            import tiktoken
+            encodings[model] = tiktoken.encoding_for_model(model)
+        except (ImportError, KeyError, OSError):
+            encodings[model] = None
+    return encodings[model]
+
+
+def count_tokens(text, model):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model):
+    return sum(count_tokens(message["content"], model) + 4 for message in messages) + 3
+
+
+def truncate(text, max_tokens, model):
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    max_tokens = max(max_tokens - count_tokens(truncation_marker, model), 0)
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4] + truncation_marker
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]) + truncation_marker
+
+
+def fit_lines(lines, max_tokens, model):
+    fitted = []
+    total = 0
+    for line in lines:
+        tokens = count_tokens(line, model) + 1
+        if total + tokens > max_tokens:
+            break
+        fitted.append(line)
+        total += tokens
+    return fitted
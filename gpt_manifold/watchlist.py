@@ -0,0 +1,46 @@
+import hashlib
+import time
+from typing import NamedTuple, Optional
+
+
+class WatchEntry(NamedTuple):
+    market_id: str
+    action: str
+    amount: int
+    probability: float
+    estimate: Optional[float]
+    description_hash: str
+    updated: float
+
+
+def hash_description(description):
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:16]
+
+
+def watch_entry(market, decision, estimate=None):
+    return WatchEntry(market.id, decision.action, decision.amount, market.probability,
+                      estimate, hash_description(market.description), time.time())
+
+
+def has_moved(entry, market, threshold):
+    return abs(market.probability - entry.probability) >= threshold
+
+
+def has_drifted(entry, market, threshold):
+    if has_moved(entry, market, threshold):
+        return True
+    return hash_description(market.description) != entry.description_hash
+
+
+def find_drifted(entries, markets, threshold):
+    drifted = []
+    closed = []
+    for entry in entries:
+        market = markets.get(entry.market_id)
+        if market is None or isinstance(market, Exception):
+            continue
+        if not market.is_open:
+            closed.append(entry.market_id)
+        elif has_drifted(entry, market, threshold):
+            drifted.append(market)
+    return drifted, closed
@@ -6,9 +6,17 @@ setup(
     version="1.1.1",
     packages=find_packages(),
     install_requires=[
+        "numpy",
         "openai",
-        "pick"
+        "pick",
+        "requests"
     ],
+    extras_require={
+        "tokenizer": ["tiktoken"]
+    },
+    entry_points={
+        "console_scripts": ["gpt-manifold=gpt_manifold.__main__:main"]
+    },
     author="Markus Sobkowski",
     author_email="sobmarski@gmail.com",
     description="An assistant for betting on prediction markets on manifold.markets, utilizing OpenAI's GPT APIs.",